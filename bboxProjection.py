@@ -0,0 +1,91 @@
+"""Bounding boxes of scene objects projected onto the camera frame
+
+Pure NumPy, so it can be used inside Blender (see imageGenerationAddon.py) as well as
+tested and benchmarked without it. Boxes use the same format as labelImages.py:
+dictionaries with object index and inclusive pixel coordinates xmin, xmax, ymin, ymax.
+"""
+import numpy as np
+
+
+def world_to_camera_view(points, camera_matrix_world, view_frame, ortho=False):
+    """NumPy port of bpy_extras.object_utils.world_to_camera_view for many points
+
+    points are (N, 3) world coordinates, camera_matrix_world is the camera's 4x4 world matrix
+    and view_frame the 4 corners returned by camera.data.view_frame(scene=scene). Returns (N, 3)
+    array of x and y relative to the frame (0-1, origin bottom left) and depth in front of camera."""
+    matrix = np.asarray(camera_matrix_world, dtype=np.float64)
+    rotation = matrix[:3, :3] / np.linalg.norm(matrix[:3, :3], axis=0)
+    local = (np.asarray(points, dtype=np.float64) - matrix[:3, 3]) @ rotation
+    z = -local[:, 2]
+
+    frame = np.asarray(view_frame, dtype=np.float64)[:3]
+    min_x, max_x = frame[2, 0], frame[1, 0]
+    min_y, max_y = frame[1, 1], frame[0, 1]
+    if ortho:
+        scale = 1
+    else:
+        scale = z / -frame[0, 2]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x = (local[:, 0] - min_x * scale) / ((max_x - min_x) * scale)
+        y = (local[:, 1] - min_y * scale) / ((max_y - min_y) * scale)
+    return np.column_stack((x, y, z))
+
+
+def project_boxes(objects_vertices, camera_matrix_world, view_frame, width, height, ortho=False):
+    """Bounding box of every object's vertices on a width x height image, clipped to the frame
+
+    objects_vertices is a list of (object index, (N, 3) world vertices). All vertices are projected
+    at once. Vertices behind the camera are ignored, objects without vertices in front of the
+    camera or completely outside the frame are left out."""
+    objects_vertices = [(index, vertices) for index, vertices in objects_vertices if len(vertices)]
+    if not objects_vertices:
+        return []
+    counts = [len(vertices) for index, vertices in objects_vertices]
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    view = world_to_camera_view(np.concatenate([vertices for index, vertices in objects_vertices]),
+                                camera_matrix_world, view_frame, ortho)
+
+    in_front = view[:, 2] > 0
+    x = view[:, 0] * width
+    y = (1 - view[:, 1]) * height
+    xmin = np.minimum.reduceat(np.where(in_front, x, np.inf), starts)
+    xmax = np.maximum.reduceat(np.where(in_front, x, -np.inf), starts)
+    ymin = np.minimum.reduceat(np.where(in_front, y, np.inf), starts)
+    ymax = np.maximum.reduceat(np.where(in_front, y, -np.inf), starts)
+    visible = (xmax >= 0) & (xmin < width) & (ymax >= 0) & (ymin < height)
+
+    objects_info = []
+    for i in np.flatnonzero(visible):
+        objects_info.append({
+            "index": objects_vertices[i][0],
+            "xmin": int(np.clip(np.floor(xmin[i]), 0, width - 1)),
+            "xmax": int(np.clip(np.floor(xmax[i]), 0, width - 1)),
+            "ymin": int(np.clip(np.floor(ymin[i]), 0, height - 1)),
+            "ymax": int(np.clip(np.floor(ymax[i]), 0, height - 1)),
+        })
+    return objects_info
+
+
+def boxes_overlap(objects_info):
+    """Check if any two boxes intersect, then objects may occlude each other"""
+    if len(objects_info) < 2:
+        return False
+    boxes = np.array([[obj["xmin"], obj["xmax"], obj["ymin"], obj["ymax"]] for obj in objects_info])
+    xmin, xmax, ymin, ymax = (boxes[:, i] for i in range(4))
+    overlap = ((xmin[:, None] <= xmax[None, :]) & (xmin[None, :] <= xmax[:, None])
+               & (ymin[:, None] <= ymax[None, :]) & (ymin[None, :] <= ymax[:, None]))
+    np.fill_diagonal(overlap, False)
+    return bool(overlap.any())
+
+
+def write_yolo_label(label_path, image_width, image_height, objects):
+    """Write boxes in the same YOLO format as labelImages.create_annotation_txt"""
+    lines = []
+    for obj in objects:
+        relCenterX = (obj["xmax"] + obj["xmin"]) / 2 / image_width
+        relCenterY = (obj["ymin"] + obj["ymax"]) / 2 / image_height
+        relWidth = (obj["xmax"] - obj["xmin"]) / image_width
+        relHeight = (obj["ymax"] - obj["ymin"]) / image_height
+        lines.append(f"{obj['index']} {relCenterX} {relCenterY} {relWidth} {relHeight} \n")
+    with open(label_path, "w") as file:
+        file.write("".join(lines))
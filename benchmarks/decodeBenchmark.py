@@ -0,0 +1,51 @@
+"""Compare decode time and peak memory of the mask decoding paths in labelImages.read_mask
+
+Every decoder runs in a fresh process so its peak RSS is not hidden by an earlier one.
+Run from the repository root:
+    python -m benchmarks.decodeBenchmark --width 1920 --height 1080
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+import labelImages
+from benchmarks.labelingBenchmark import make_mask
+
+
+def measure(image_path, decode, repeat):
+    """Return mean decode time in ms and peak RSS growth in MB of decoding one image repeatedly"""
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    for _ in range(repeat):
+        red, scale = labelImages.read_mask(image_path, decode)
+        np.asarray(red).max()
+    elapsed = (time.perf_counter() - start) / repeat
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline
+    return elapsed * 1000, peak / 1024
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark mask decoding paths.")
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--objects", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    image = make_mask(args.width, args.height, args.objects)
+    context = multiprocessing.get_context("spawn")
+    print(f"{'file':6} {'decode':9} {'ms/image':>9} {'peak MB':>8}")
+    with tempfile.TemporaryDirectory() as folder:
+        for extension in (".png", ".jpg", ".bmp"):
+            image_path = os.path.join(folder, "mask" + extension)
+            cv2.imwrite(image_path, image)
+            for decode in labelImages.DECODERS:
+                with context.Pool(1) as pool:
+                    milliseconds, peak = pool.apply(measure, (image_path, decode, args.repeat))
+                print(f"{extension:6} {decode:9} {milliseconds:9.2f} {peak:8.1f}")
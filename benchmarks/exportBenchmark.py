@@ -0,0 +1,81 @@
+"""Compare one-pass multi-format export against labeling to YOLO and converting afterwards
+
+Run from the repository root:
+    python -m benchmarks.exportBenchmark --images 500 --workers 4
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import cv2
+
+import labelImages
+from benchmarks.labelingBenchmark import make_mask
+
+
+def yolo_to_annotations(label_folder, image_folder):
+    """Parse YOLO .txt files back into (name, width, height, objects), as a separate converter would"""
+    for label_filename in sorted(os.listdir(label_folder)):
+        if not label_filename.endswith(".txt"):
+            continue
+        name = os.path.splitext(label_filename)[0] + ".png"
+        height, width = cv2.imread(os.path.join(image_folder, name)).shape[:2]
+        objects_info = []
+        with open(os.path.join(label_folder, label_filename)) as file:
+            for line in file:
+                index, center_x, center_y, box_width, box_height = line.split()
+                center_x, box_width = float(center_x) * width, float(box_width) * width
+                center_y, box_height = float(center_y) * height, float(box_height) * height
+                objects_info.append({
+                    "index": int(index),
+                    "xmin": round(center_x - box_width / 2),
+                    "xmax": round(center_x + box_width / 2),
+                    "ymin": round(center_y - box_height / 2),
+                    "ymax": round(center_y + box_height / 2),
+                })
+        yield name, width, height, objects_info
+
+
+def label(source, dest, classes_path, label_format, workers):
+    args = labelImages.build_parser().parse_args(
+        ["--source", source, "--dest", dest, "--classes", classes_path, "--format", label_format])
+    labelImages.process_images_parallel_in_folder(args, num_processes=workers)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark multi-format export against separate converters.")
+    parser.add_argument("--images", type=int, default=200)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--objects", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=labelImages.default_workers())
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        source = os.path.join(folder, "black")
+        classes_path = os.path.join(folder, "classes.txt")
+        os.mkdir(source)
+        for i in range(args.images):
+            cv2.imwrite(os.path.join(source, f"render{i}.png"), make_mask(args.width, args.height, args.objects, seed=i))
+        with open(classes_path, "w") as file:
+            file.write("\n".join(f"class{i}" for i in range(args.objects)))
+        classes = labelImages.read_classes_from_file(classes_path)
+
+        one_pass = os.path.join(folder, "one_pass")
+        os.mkdir(one_pass)
+        start = time.perf_counter()
+        label(source, one_pass, classes_path, "all", args.workers)
+        one_pass_time = time.perf_counter() - start
+
+        separate = os.path.join(folder, "separate")
+        os.mkdir(separate)
+        start = time.perf_counter()
+        label(source, separate, classes_path, "yolo", args.workers)
+        labelImages.write_coco_json(yolo_to_annotations(separate, source), classes, os.path.join(separate, labelImages.COCO_FILENAME))
+        for name, width, height, objects_info in yolo_to_annotations(separate, source):
+            labelImages.create_annotation_xml(name, separate, width, height, objects_info, classes)
+        separate_time = time.perf_counter() - start
+
+    print(f"one pass (yolo+coco+voc):  {one_pass_time:7.2f} s, {args.images / one_pass_time:8.1f} images/s")
+    print(f"yolo + separate converters: {separate_time:7.2f} s, {args.images / separate_time:8.1f} images/s")
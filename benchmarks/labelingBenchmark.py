@@ -0,0 +1,88 @@
+"""Compare per-image labeling time of the vectorized engines against the original per-pixel loop
+
+Run from the repository root:
+    python -m benchmarks.labelingBenchmark --width 1920 --height 1080 --objects 20
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import labelImages
+
+
+def make_mask(width, height, num_objects, seed=0):
+    """Draw one filled rectangle per object using the emission palette from setup_materials"""
+    rng = np.random.default_rng(seed)
+    image = np.zeros((height, width, 3), dtype=np.uint8)
+    for i in range(num_objects):
+        r = round((i + 1) * (255 / num_objects))
+        x0, y0 = rng.integers(0, width - 40), rng.integers(0, height - 40)
+        x1, y1 = x0 + rng.integers(10, 40 + width // 8), y0 + rng.integers(10, 40 + height // 8)
+        image[y0:y1, x0:x1, 2] = r
+    return image
+
+
+def find_objects_loop(image, num_objects, stride=2):
+    """Original per-pixel labeling loop, kept as the reference implementation"""
+    height, width, channels = image.shape
+    objects_info = []
+    delta_red = 255 / num_objects
+    for object_index in range(num_objects):
+        object_red_channel = (object_index + 1) * delta_red
+        top, bottom, left, right = height, 0, width, 0
+        found = False
+        for y in range(0, height, stride):
+            for x in range(0, width, stride):
+                b, g, r = image[y, x]
+                if object_red_channel - 1 <= r <= object_red_channel + 1:
+                    found = True
+                    top = min(top, y)
+                    bottom = max(bottom, y)
+                    left = min(left, x)
+                    right = max(right, x)
+        if found:
+            objects_info.append({"index": object_index, "xmin": left, "xmax": right, "ymin": top, "ymax": bottom})
+    return objects_info
+
+
+def time_call(function, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def annotation_text(objects_info, width, height):
+    with tempfile.TemporaryDirectory() as folder:
+        image_path = os.path.join(folder, "mask.png")
+        labelImages.create_annotation_txt(image_path, folder, width, height, objects_info)
+        with open(os.path.join(folder, "mask.txt"), "rb") as file:
+            return file.read()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark labeling engine against the per-pixel loop.")
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--objects", type=int, default=20)
+    parser.add_argument("--stride", type=int, default=2)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--skip-loop", action="store_true", help="Only time the vectorized engine")
+    args = parser.parse_args()
+
+    image = make_mask(args.width, args.height, args.objects)
+    vector_time, vector_objects = time_call(lambda: labelImages.find_objects(image, args.objects, args.stride), args.repeat)
+    print(f"vectorized: {vector_time * 1000:9.2f} ms/image")
+    components_time, _ = time_call(lambda: labelImages.find_object_instances(image, args.objects, args.stride), args.repeat)
+    print(f"components: {components_time * 1000:9.2f} ms/image")
+
+    if not args.skip_loop:
+        loop_time, loop_objects = time_call(lambda: find_objects_loop(image, args.objects, args.stride), 1)
+        print(f"loop:       {loop_time * 1000:9.2f} ms/image ({loop_time / vector_time:.0f}x slower)")
+        identical = annotation_text(vector_objects, args.width, args.height) == annotation_text(loop_objects, args.width, args.height)
+        print(f"identical output: {identical}")
@@ -0,0 +1,65 @@
+"""Time writing and labeling masks in every mask format the addon can write
+
+Blender is not needed: masks are written with OpenCV using the settings the addon
+uses (uncompressed PNG, half float EXR without compression, JPEG quality 90), which
+stands in for the render write. Boxes are compared against the 8 bit PNG result.
+Run from the repository root:
+    python -m benchmarks.maskFormatBenchmark --images 50
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+import labelImages
+from benchmarks.labelingBenchmark import make_mask
+
+
+def write_mask(image_path, image):
+    extension = os.path.splitext(image_path)[1]
+    if extension == ".npy":
+        np.save(image_path, image[:, :, 2])
+    elif extension == ".exr":
+        cv2.imwrite(image_path, image.astype(np.float32) / 255,
+                    [cv2.IMWRITE_EXR_TYPE, cv2.IMWRITE_EXR_TYPE_HALF, cv2.IMWRITE_EXR_COMPRESSION, cv2.IMWRITE_EXR_COMPRESSION_NO])
+    elif extension == ".png16":
+        cv2.imwrite(image_path[:-2], image.astype(np.uint16) * 257, [cv2.IMWRITE_PNG_COMPRESSION, 0])
+    elif extension == ".png":
+        cv2.imwrite(image_path, image, [cv2.IMWRITE_PNG_COMPRESSION, 0])
+    else:
+        cv2.imwrite(image_path, image, [cv2.IMWRITE_JPEG_QUALITY, 90])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark mask formats for render write plus label read.")
+    parser.add_argument("--images", type=int, default=50)
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--objects", type=int, default=20)
+    args = parser.parse_args()
+
+    masks = [make_mask(args.width, args.height, args.objects, seed=i) for i in range(args.images)]
+    reference = [labelImages.find_objects(mask, args.objects) for mask in masks]
+    print(f"{'format':7} {'write ms':>9} {'read+label ms':>14} {'MB/image':>9} {'wrong boxes':>12}")
+    with tempfile.TemporaryDirectory() as folder:
+        for extension in (".png", ".png16", ".bmp", ".exr", ".npy", ".jpg"):
+            paths = [os.path.join(folder, f"render{i}{extension}") for i in range(args.images)]
+            start = time.perf_counter()
+            for image_path, mask in zip(paths, masks):
+                write_mask(image_path, mask)
+            write_time = (time.perf_counter() - start) / args.images
+
+            paths = [image_path[:-2] if extension == ".png16" else image_path for image_path in paths]
+            decode = "raw" if extension == ".bmp" else "full"
+            start = time.perf_counter()
+            results = [labelImages.label_image(image_path, args.objects, decode=decode)[2] for image_path in paths]
+            read_time = (time.perf_counter() - start) / args.images
+
+            size = sum(os.path.getsize(image_path) for image_path in paths) / args.images / 2 ** 20
+            wrong = sum(result != expected for result, expected in zip(results, reference))
+            print(f"{extension[1:]:7} {write_time * 1000:9.2f} {read_time * 1000:14.2f} {size:9.2f} {wrong:7d}/{args.images}")
+            for image_path in paths:
+                os.remove(image_path)
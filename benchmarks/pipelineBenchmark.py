@@ -0,0 +1,91 @@
+"""End to end labeler benchmark on synthetic masks: images/s, peak RSS, worker scaling and accuracy
+
+Every run labels the whole dataset into a fresh folder in a spawned process, so peak RSS
+of one run is not hidden by an earlier one. Needs only NumPy and OpenCV.
+Run from the repository root:
+    python -m benchmarks.pipelineBenchmark --images 200 --workers 1 2 4
+    python -m benchmarks.pipelineBenchmark --objects 40 --classes 6 --json
+    python -m benchmarks.pipelineBenchmark --encoding jpg
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import tempfile
+import time
+
+import labelImages
+from benchmarks import syntheticMasks
+
+
+def run_labeler(labeler_args, workers, results):
+    """Label folder, put seconds and peak RSS in MB of this process and of its workers to results queue"""
+    args = labelImages.build_parser().parse_args(labeler_args)
+    start = time.perf_counter()
+    labelImages.process_images_parallel_in_folder(args, num_processes=workers)
+    elapsed = time.perf_counter() - start
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    results.put((elapsed, peak / 1024))
+
+def read_annotations(dest):
+    manifest = labelImages.open_manifest(dest)
+    annotations = list(labelImages.manifest_annotations(manifest))
+    manifest.close()
+    return annotations
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark labeling end to end on synthetic masks.")
+    parser.add_argument("--images", type=int, default=200)
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--objects", type=int, default=20)
+    parser.add_argument("--classes", type=int, default=None, help="Number of classes (default: one per object, red palette)")
+    parser.add_argument("--overlap", type=float, default=0.3)
+    parser.add_argument("--encoding", choices=syntheticMasks.ENCODINGS, default="png")
+    parser.add_argument("--quality", type=int, default=95, help="JPEG quality")
+    parser.add_argument("--stride", type=int, default=1)
+    parser.add_argument("--mode", choices=("boxes", "components"), default="boxes")
+    parser.add_argument("--decode", choices=labelImages.DECODERS, default="full")
+    parser.add_argument("--segments", choices=list(labelImages.SEGMENT_OPTIONS), default="none")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="Print results as JSON, e.g. to compare runs in CI")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        classes_path = syntheticMasks.write_dataset(folder, args.images, args.width, args.height, args.objects,
+                                                    args.classes or args.objects, args.overlap, args.encoding,
+                                                    args.quality, args.seed)
+        ground_truth = syntheticMasks.load_ground_truth(folder)
+        for workers in args.workers:
+            dest = os.path.join(folder, f"labels{workers}")
+            os.mkdir(dest)
+            labeler_args = ["--source", os.path.join(folder, "black"), "--dest", dest, "--classes", classes_path,
+                            "--stride", str(args.stride), "--mode", args.mode, "--decode", args.decode, "--segments", args.segments]
+            # Not a pool worker, those can not start the labeler's own pool
+            queue = context.Queue()
+            process = context.Process(target=run_labeler, args=(labeler_args, workers, queue))
+            process.start()
+            process.join()
+            if process.exitcode != 0:
+                raise RuntimeError(f"Labeling with {workers} workers failed")
+            elapsed, peak = queue.get()
+            result = {"workers": workers, "seconds": elapsed, "images_per_second": args.images / elapsed, "peak_rss_mb": peak}
+            result.update(syntheticMasks.accuracy(ground_truth, read_annotations(dest)))
+            results.append(result)
+            shutil.rmtree(dest)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        base = results[0]["images_per_second"]
+        print(f"{'workers':>7} {'images/s':>9} {'speedup':>7} {'peak MB':>8} {'recall':>7} {'precision':>9} {'mean IoU':>8} {'exact':>6}")
+        for result in results:
+            print(f"{result['workers']:7} {result['images_per_second']:9.1f} {result['images_per_second'] / base:7.2f} "
+                  f"{result['peak_rss_mb']:8.1f} {result['recall']:7.3f} {result['precision']:9.3f} "
+                  f"{result['mean_iou']:8.3f} {result['exact_images']:6.1%}")
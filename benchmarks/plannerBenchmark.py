@@ -0,0 +1,35 @@
+"""Time planning a run with scenePlanner and check that no bounding circles overlap
+
+Run from the repository root:
+    python -m benchmarks.plannerBenchmark --images 100000 --objects 20 --max-offset 10
+"""
+import argparse
+import time
+
+import numpy as np
+
+import scenePlanner
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark scene planning.")
+    parser.add_argument("--images", type=int, default=10000)
+    parser.add_argument("--objects", type=int, default=20)
+    parser.add_argument("--max-offset", type=float, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    radii = rng.uniform(0.3, 1, args.objects)
+    default_angles = [(90, 0, 0, 2) if i % 2 else None for i in range(args.objects)]
+
+    start = time.perf_counter()
+    plan, overlapping = scenePlanner.make_plan(args.seed, 0, args.images, radii, np.sqrt(2 * radii), default_angles, args.max_offset)
+    elapsed = time.perf_counter() - start
+
+    xy = plan["locations"][:, :, :2].astype(np.float64)
+    distance = np.linalg.norm(xy[:, :, None] - xy[:, None, :], axis=3)
+    upper = np.triu_indices(args.objects, 1)
+    overlaps = (distance < (radii[:, None] + radii[None, :]) - 1e-4)[:, upper[0], upper[1]].sum()
+    print(f"{args.images} images x {args.objects} objects: {elapsed:.2f} s, {args.images / elapsed:.0f} images/s")
+    print(f"overlapping pairs: {overlaps}, objects placed overlapping after {scenePlanner.MAX_ATTEMPTS} attempts: {overlapping}")
@@ -0,0 +1,36 @@
+"""Time projecting object vertices to bounding boxes with bboxProjection, no Blender needed
+
+Run from the repository root:
+    python -m benchmarks.projectionBenchmark --objects 20 --vertices 5000
+"""
+import argparse
+import time
+
+import numpy as np
+
+import bboxProjection
+
+# Camera 10 units above the origin looking down, 16:9 frame as returned by view_frame
+CAMERA_MATRIX_WORLD = np.array([[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 1, 10], [0, 0, 0, 1]], dtype=float)
+VIEW_FRAME = [(1, 0.5625, -2.5), (1, -0.5625, -2.5), (-1, -0.5625, -2.5), (-1, 0.5625, -2.5)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark bounding box projection.")
+    parser.add_argument("--objects", type=int, default=20)
+    parser.add_argument("--vertices", type=int, default=5000, help="Vertices per object")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    objects_vertices = [(i, rng.uniform(-1, 1, (args.vertices, 3)) + rng.uniform(-3, 3, 3) * [1, 1, 0])
+                        for i in range(args.objects)]
+
+    best = float("inf")
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        objects_info = bboxProjection.project_boxes(objects_vertices, CAMERA_MATRIX_WORLD, VIEW_FRAME, 1920, 1080)
+        overlap = bboxProjection.boxes_overlap(objects_info)
+        best = min(best, time.perf_counter() - start)
+    print(f"{args.objects} objects x {args.vertices} vertices: {best * 1000:.2f} ms/image, "
+          f"{len(objects_info)} boxes, overlap: {overlap}")
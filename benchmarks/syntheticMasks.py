@@ -0,0 +1,171 @@
+"""Synthetic emission masks with ground truth boxes, no Blender needed
+
+Objects are filled rotated ellipses drawn without antialiasing, like the Eevee mask pass
+with filter size 0. Later objects occlude earlier ones and ground truth is the box of the
+visible pixels. Colors use the palette math of setup_materials in the addon: one red level
+per object when every object is its own class, the maskPalette RGB ids otherwise.
+
+Write a dataset from the repository root:
+    python -m benchmarks.syntheticMasks --dest /tmp/masks --images 100 --objects 30 --classes 5
+"""
+import argparse
+import json
+import os
+
+import cv2
+import numpy as np
+
+import maskPalette
+
+ENCODINGS = {"png": ".png", "jpg": ".jpg", "bmp": ".bmp"}
+GROUND_TRUTH_FILENAME = "ground_truth.json"
+
+
+def red_color(object_index, num_objects):
+    """BGR color of object in the red palette, as rendered from setup_materials emission"""
+    return 0, 0, round((object_index + 1) * (255 / num_objects))
+
+def rgb_id_color(object_index):
+    """BGR color of object in the RGB id palette"""
+    r, g, b = maskPalette.id_color(object_index + 1)
+    return b, g, r
+
+def object_classes(num_objects, num_classes, rng):
+    """Class index of every object, each object its own class when the counts match"""
+    if num_objects == num_classes:
+        return list(range(num_objects))
+    return [int(class_index) for class_index in rng.integers(0, num_classes, num_objects)]
+
+def make_scene(width, height, num_objects, overlap, rng, use_palette):
+    """Draw one mask, return BGR image and object id map (0 background, object index + 1)
+
+    overlap is the probability that an object is centered inside an earlier object."""
+    image = np.zeros((height, width, 3), dtype=np.uint8)
+    ids = np.zeros((height, width), dtype=np.uint8)
+    centers = []
+    for i in range(num_objects):
+        axes = (int(rng.integers(5, 10 + width // 12)), int(rng.integers(5, 10 + height // 12)))
+        if centers and rng.random() < overlap:
+            center = centers[rng.integers(len(centers))]
+            center = (int(center[0] + rng.integers(-axes[0], axes[0] + 1)), int(center[1] + rng.integers(-axes[1], axes[1] + 1)))
+        else:
+            center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        centers.append(center)
+        angle = float(rng.uniform(0, 180))
+        color = rgb_id_color(i) if use_palette else red_color(i, num_objects)
+        cv2.ellipse(image, center, axes, angle, 0, 360, color, -1, cv2.LINE_8)
+        cv2.ellipse(ids, center, axes, angle, 0, 360, i + 1, -1, cv2.LINE_8)
+    return image, ids
+
+def ground_truth_boxes(ids, classes):
+    """Inclusive pixel box [class, xmin, xmax, ymin, ymax] of the visible part of every object"""
+    boxes = []
+    for i, class_index in enumerate(classes):
+        rows = np.flatnonzero((ids == i + 1).any(axis=1))
+        if len(rows) == 0:
+            continue
+        columns = np.flatnonzero((ids[rows[0]:rows[-1] + 1] == i + 1).any(axis=0))
+        boxes.append([class_index, int(columns[0]), int(columns[-1]), int(rows[0]), int(rows[-1])])
+    return boxes
+
+def write_dataset(dest, num_images, width, height, num_objects, num_classes, overlap=0.3, encoding="png", quality=95, seed=0):
+    """Write masks, classes.txt, palette.json if needed and ground truth, return classes path
+
+    Masks go to dest/black like the addon writes them."""
+    if num_classes > num_objects:
+        raise ValueError("Need at least one object per class")
+    use_palette = num_classes != num_objects
+    mask_folder = os.path.join(dest, "black")
+    os.makedirs(mask_folder, exist_ok=True)
+    classes_path = os.path.join(dest, "classes.txt")
+    with open(classes_path, "w") as file:
+        file.write("".join(f"class{i}\n" for i in range(num_classes)))
+
+    rng = np.random.default_rng(seed)
+    classes = object_classes(num_objects, num_classes, rng)
+    palette_path = os.path.join(mask_folder, maskPalette.PALETTE_FILENAME)
+    if use_palette:
+        maskPalette.save_palette(palette_path, maskPalette.make_palette(classes))
+    elif os.path.exists(palette_path):
+        os.remove(palette_path)
+
+    extension = ENCODINGS[encoding]
+    params = [cv2.IMWRITE_JPEG_QUALITY, quality] if encoding == "jpg" else []
+    ground_truth = {}
+    for i in range(num_images):
+        image, ids = make_scene(width, height, num_objects, overlap, rng, use_palette)
+        name = f"render{i}{extension}"
+        cv2.imwrite(os.path.join(mask_folder, name), image, params)
+        ground_truth[name] = [width, height, ground_truth_boxes(ids, classes)]
+    with open(os.path.join(dest, GROUND_TRUTH_FILENAME), "w") as file:
+        json.dump(ground_truth, file)
+    return classes_path
+
+def load_ground_truth(dest):
+    with open(os.path.join(dest, GROUND_TRUTH_FILENAME)) as file:
+        return json.load(file)
+
+
+def box_iou(a, b):
+    """IoU of inclusive pixel boxes (xmin, xmax, ymin, ymax)"""
+    width = min(a[1], b[1]) - max(a[0], b[0]) + 1
+    height = min(a[3], b[3]) - max(a[2], b[2]) + 1
+    if width <= 0 or height <= 0:
+        return 0.0
+    intersection = width * height
+    area_a = (a[1] - a[0] + 1) * (a[3] - a[2] + 1)
+    area_b = (b[1] - b[0] + 1) * (b[3] - b[2] + 1)
+    return intersection / (area_a + area_b - intersection)
+
+def match_boxes(truth, found):
+    """Greedily match same-class boxes by IoU, return IoUs of matches"""
+    pairs = sorted(((box_iou(t[1:], f[1:]), i, j) for i, t in enumerate(truth) for j, f in enumerate(found) if t[0] == f[0]), reverse=True)
+    used_truth, used_found, ious = set(), set(), []
+    for iou, i, j in pairs:
+        if iou > 0 and i not in used_truth and j not in used_found:
+            used_truth.add(i)
+            used_found.add(j)
+            ious.append(iou)
+    return ious
+
+def accuracy(ground_truth, annotations, iou_threshold=0.9):
+    """Compare (name, width, height, objects) annotations with ground truth
+
+    Returns recall and precision at iou_threshold, mean IoU of matched boxes and the
+    fraction of images whose boxes are exactly right."""
+    truth_count = found_count = hits = exact = 0
+    matched_ious = []
+    for name, width, height, objects_info in annotations:
+        truth = ground_truth[name][2]
+        found = [[obj["index"], obj["xmin"], obj["xmax"], obj["ymin"], obj["ymax"]] for obj in objects_info]
+        ious = match_boxes(truth, found)
+        truth_count += len(truth)
+        found_count += len(found)
+        hits += sum(iou >= iou_threshold for iou in ious)
+        matched_ious += ious
+        exact += sorted(truth) == sorted(found)
+    return {
+        "recall": hits / max(truth_count, 1),
+        "precision": hits / max(found_count, 1),
+        "mean_iou": float(np.mean(matched_ious)) if matched_ious else 0.0,
+        "exact_images": exact / max(len(ground_truth), 1),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Write synthetic emission masks with ground truth boxes.")
+    parser.add_argument("--dest", type=str, required=True)
+    parser.add_argument("--images", type=int, default=100)
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--objects", type=int, default=20)
+    parser.add_argument("--classes", type=int, default=None, help="Number of classes (default: one per object, red palette)")
+    parser.add_argument("--overlap", type=float, default=0.3)
+    parser.add_argument("--encoding", choices=ENCODINGS, default="png")
+    parser.add_argument("--quality", type=int, default=95, help="JPEG quality")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    write_dataset(args.dest, args.images, args.width, args.height, args.objects, args.classes or args.objects,
+                  args.overlap, args.encoding, args.quality, args.seed)
+    print(f"Wrote {args.images} masks to {os.path.join(args.dest, 'black')}")
@@ -0,0 +1,174 @@
+"""Composite transparent foreground renders onto many backgrounds
+
+The addon writes RGBA renders with Background set to Transparent. Every render is alpha
+blended onto K backgrounds sampled from a folder. The background is scaled to cover the
+render with random extra zoom, and a random crop is taken. The foreground is never moved,
+so the render's YOLO and VOC labels are copied to every composite.
+"""
+import os
+# OpenCV reads EXR renders only when enabled before it is imported
+os.environ.setdefault("OPENCV_IO_ENABLE_OPENEXR", "1")
+import cv2
+import functools
+import numpy as np
+import time
+import zlib
+from multiprocessing import Pool
+import argparse
+from xml.etree import ElementTree
+
+from labelImages import default_workers
+from maskLabeling import to_uint8
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.exr', '.webp')
+
+
+def read_background(background_path):
+    """Read background as 8 bit BGR"""
+    background = cv2.imread(background_path, cv2.IMREAD_COLOR)
+    if background is None:
+        print(f"Error loading the background: {background_path}")
+    return background
+
+# Replaced in every worker by an LRU cached version, see init_worker
+load_background = read_background
+
+def init_worker(cache_size):
+    """Keep up to cache_size decoded backgrounds per worker process"""
+    global load_background
+    cv2.setNumThreads(1)
+    load_background = functools.lru_cache(maxsize=cache_size)(read_background)
+
+def crop_background(background, width, height, scale, x, y):
+    """Cut region covering width x height at scale times the covering zoom, x and y (0-1) place the crop
+
+    Only the cropped region is resized."""
+    background_height, background_width = background.shape[:2]
+    zoom = max(width / background_width, height / background_height) * scale
+    crop_width = min(background_width, max(1, round(width / zoom)))
+    crop_height = min(background_height, max(1, round(height / zoom)))
+    left = round(x * (background_width - crop_width))
+    top = round(y * (background_height - crop_height))
+    crop = background[top:top + crop_height, left:left + crop_width]
+    interpolation = cv2.INTER_AREA if zoom < 1 else cv2.INTER_LINEAR
+    return cv2.resize(crop, (width, height), interpolation=interpolation)
+
+def blend_weights(foreground):
+    """Split BGRA foreground into BGR and the weights of foreground and background, once per render"""
+    weight = foreground[:, :, 3].astype(np.float32) * (1 / 255)
+    return np.ascontiguousarray(foreground[:, :, :3]), weight, 1 - weight
+
+def alpha_blend(color, weight, background_weight, background):
+    """Blend foreground from blend_weights over BGR background of the same size"""
+    return cv2.blendLinear(color, background, weight, background_weight)
+
+def read_foreground(image_path):
+    """Read render as 8 bit BGRA, renders without alpha are opaque"""
+    image = cv2.imread(image_path, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        return None
+    image = to_uint8(image)
+    if image.ndim == 2:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGRA)
+    elif image.shape[2] == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2BGRA)
+    return image
+
+def copy_labels(stem, labels_folder, dest_folder, composite_stem, composite_filename):
+    """Copy YOLO and VOC labels of render stem to composite, return number of copied files"""
+    copied = 0
+    yolo_path = os.path.join(labels_folder, stem + ".txt")
+    if os.path.exists(yolo_path):
+        with open(yolo_path, 'rb') as file:
+            label = file.read()
+        with open(os.path.join(dest_folder, composite_stem + ".txt"), 'wb') as file:
+            file.write(label)
+        copied += 1
+    voc_path = os.path.join(labels_folder, stem + ".xml")
+    if os.path.exists(voc_path):
+        tree = ElementTree.parse(voc_path)
+        tree.getroot().find("filename").text = composite_filename
+        tree.write(os.path.join(dest_folder, composite_stem + ".xml"))
+        copied += 1
+    return copied
+
+def composite_image(image_path, backgrounds, labels_folder, dest_folder, copies, max_zoom, seed, quality):
+    """Write copies composites of one render with their labels, return number of composites written"""
+    foreground = read_foreground(image_path)
+    if foreground is None:
+        print(f"Error loading the image: {image_path}")
+        return 0
+    height, width = foreground.shape[:2]
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    # Same backgrounds and crops for the same render and seed, whatever the worker
+    rng = np.random.default_rng([seed, zlib.crc32(stem.encode())])
+    weights = blend_weights(foreground)
+
+    written = 0
+    for copy in range(copies):
+        background_path = backgrounds[rng.integers(len(backgrounds))]
+        scale, x, y = rng.uniform(1, max_zoom), rng.random(), rng.random()
+        background = load_background(background_path)
+        if background is None:
+            continue
+        background = crop_background(background, width, height, scale, x, y)
+        composite_stem = f"{stem}_bg{copy}"
+        composite_filename = composite_stem + ".jpg"
+        composite = alpha_blend(*weights, background)
+        cv2.imwrite(os.path.join(dest_folder, "images", composite_filename), composite, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if labels_folder:
+            copy_labels(stem, labels_folder, os.path.join(dest_folder, "labels"), composite_stem, composite_filename)
+        written += 1
+    return written
+
+def composite_image_wrapper(args):
+    return composite_image(*args)
+
+def list_images(folder):
+    """Sorted paths of all images in folder"""
+    return sorted(entry.path for entry in os.scandir(folder) if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS))
+
+def composite_folder(args):
+    """Composite every render in source folder onto args.copies backgrounds"""
+    renders = list_images(args.source)
+    backgrounds = list_images(args.backgrounds)
+    if not renders or not backgrounds:
+        print(f"Nothing to composite: {len(renders)} renders, {len(backgrounds)} backgrounds")
+        return
+    os.makedirs(os.path.join(args.dest, "images"), exist_ok=True)
+    os.makedirs(os.path.join(args.dest, "labels"), exist_ok=True)
+
+    num_processes = args.workers or default_workers()
+    chunksize = max(1, min(16, len(renders) // (num_processes * 4)))
+    print(f"Compositing {len(renders)} renders onto {args.copies} of {len(backgrounds)} backgrounds with {num_processes} workers")
+    start = time.perf_counter()
+    tasks = ((path, backgrounds, args.labels, args.dest, args.copies, args.max_zoom, args.seed, args.quality) for path in renders)
+    written = 0
+    with Pool(processes=num_processes, initializer=init_worker, initargs=(args.cache_size,)) as pool:
+        for count in pool.imap_unordered(composite_image_wrapper, tasks, chunksize=chunksize):
+            written += count
+    elapsed = time.perf_counter() - start
+    print(f"Wrote {written} images in {elapsed:.2f} s ({written / max(elapsed, 1e-9):.1f} images/s)")
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Composite transparent renders onto background images.")
+    parser.add_argument("--source", type=str, required=True, help="Folder with transparent RGBA renders")
+    parser.add_argument("--backgrounds", type=str, required=True, help="Folder with background images")
+    parser.add_argument("--dest", type=str, required=True, help="Output folder, images and labels subfolders are created")
+    parser.add_argument("--labels", type=str, default=None, help="Folder with YOLO (.txt) and/or VOC (.xml) labels of the renders")
+    parser.add_argument("--copies", type=int, default=5, help="Backgrounds per render")
+    parser.add_argument("--max-zoom", type=float, default=1.5, help="Largest extra background zoom over just covering the render")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of background sampling and crops")
+    parser.add_argument("--quality", type=int, default=95, help="JPEG quality of composites")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: usable CPUs)")
+    parser.add_argument("--cache-size", type=int, default=8, help="Decoded backgrounds kept per worker")
+    return parser
+
+if __name__ == '__main__':
+    parser = build_parser()
+    args = parser.parse_args()
+    if args.copies < 1:
+        parser.error("--copies must be at least 1")
+    if args.max_zoom < 1:
+        parser.error("--max-zoom must be at least 1")
+    composite_folder(args)
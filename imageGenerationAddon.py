@@ -13,13 +13,26 @@ bl_info = {
 
 import bpy
 import math
+import numpy as np
 import os
 import random
 import sys
+import time
+
+# Helper modules live next to this file
+addon_folder = os.path.dirname(os.path.abspath(__file__))
+if addon_folder not in sys.path:
+    sys.path.append(addon_folder)
+import bboxProjection
+import maskLabeling
+import maskPalette
+import stageTimer
+import scenePlanner
 
 from bpy.props import (StringProperty,
                        IntProperty,
                        FloatProperty,
+                       EnumProperty,
                        PointerProperty,
                        )
 from bpy.types import (Panel,
@@ -27,6 +40,28 @@ from bpy.types import (Panel,
                        PropertyGroup,
                        )
 
+# Written to the black folder after the last render, see labelImages.py --watch
+SENTINEL_FILENAME = ".done"
+
+# Consecutive frames without movement after which simulation is settled
+SETTLE_FRAMES = 3
+
+# Mask format: (file format, color depth, extension), extensions must be in labelImages.MASK_EXTENSIONS
+MASK_FORMATS = {
+    "PNG": ("PNG", "8", ".png"),
+    "PNG16": ("PNG", "16", ".png"),
+    "BMP": ("BMP", None, ".bmp"),
+    "OPEN_EXR": ("OPEN_EXR", "16", ".exr"),
+    "JPEG": ("JPEG", None, ".jpg"),
+}
+
+# Cycles render profile: (max samples, adaptive noise threshold, adaptive min samples)
+RENDER_PROFILES = {
+    "DRAFT": (64, 0.1, 8),
+    "BALANCED": (256, 0.03, 16),
+    "FINAL": (1024, 0.01, 32),
+}
+
 def update_environment_strength(self, context):
     """Update environmet texture strength"""
     bpy.data.worlds["World"].node_tree.nodes["Background"].inputs[1].default_value = self.environment_strength
@@ -92,7 +127,130 @@ class MyProperties(PropertyGroup):
         default="",
         subtype='FILE_PATH'
         )
+
+    plan_path: StringProperty(
+        name = "Scene Plan",
+        description = "Plan of object locations and rotations (.npy), made on first use. Empty to randomize while rendering",
+        default="",
+        subtype='FILE_PATH'
+        )
         
+    mask_format: EnumProperty(
+        name = "Mask Format",
+        items = [
+            ("PNG", "PNG", "Uncompressed 8 bit PNG"),
+            ("PNG16", "PNG 16 bit", "Uncompressed 16 bit PNG"),
+            ("BMP", "BMP", "Uncompressed BMP, labeler can read it without decoding"),
+            ("OPEN_EXR", "OpenEXR", "Half float EXR without compression"),
+            ("JPEG", "JPEG", "Lossy, compression artifacts grow bounding boxes"),
+        ],
+        default = "PNG"
+        )
+
+    timings_path: StringProperty(
+        name = "Timings File",
+        description = "Append per-stage timing records (JSONL) to this file, summarize with stageTimer.py. Empty to disable",
+        default="",
+        subtype='FILE_PATH'
+        )
+
+    render_profile: EnumProperty(
+        name = "Render Profile",
+        description = "Cycles quality settings applied once per run. Persistent data only saves scene sync with Object Index render passes",
+        items = [
+            ("KEEP", "Keep", "Use render settings of the .blend file"),
+            ("DRAFT", "Draft", "64 samples at most, noise threshold 0.1, denoised"),
+            ("BALANCED", "Balanced", "256 samples at most, noise threshold 0.03, denoised"),
+            ("FINAL", "Final", "1024 samples at most, noise threshold 0.01, denoised"),
+        ],
+        default = "KEEP"
+        )
+
+    render_time_limit: FloatProperty(
+        name = "Render Time Limit",
+        description = "Seconds Cycles may spend on one image, 0 for no limit (render profiles only)",
+        default = 0,
+        min = 0,
+        max = 3600
+        )
+
+    background_mode: EnumProperty(
+        name = "Background",
+        items = [
+            ("COMPOSITOR", "Camera Background", "Composite camera background image behind every render"),
+            ("TRANSPARENT", "Transparent", "Write RGBA PNG renders with shadows, add backgrounds later with compositeBackgrounds.py"),
+        ],
+        default = "COMPOSITOR"
+        )
+
+    mask_palette: EnumProperty(
+        name = "Mask Palette",
+        description = "Colors of emission masks (Cycles + Eevee render passes only)",
+        items = [
+            ("RED", "Red", "One red level per object, one class per object"),
+            ("RGB_ID", "RGB ID", "Up to 255 objects with classes from object's class_index custom property, writes palette.json. Needs a lossless mask format, not JPEG"),
+        ],
+        default = "RED"
+        )
+
+    annotation_mode: EnumProperty(
+        name = "Annotation",
+        items = [
+            ("MASK", "Mask", "Render emission mask of every image for labelImages.py"),
+            ("PROJECTION", "Projection", "Write YOLO labels from projected object vertices, render mask only when boxes overlap"),
+        ],
+        default = "MASK"
+        )
+
+    max_simulation_frames: IntProperty(
+        name = "Max Simulation Frames",
+        description = "Frames simulated at most, 0 for one second",
+        default = 0,
+        min = 0,
+        max = 10000
+        )
+
+    settle_threshold: FloatProperty(
+        name = "Settle Threshold",
+        description = "Simulation stops when no object moves more than this per frame, 0 to always simulate all frames",
+        default = 0.001,
+        min = 0,
+        max = 1,
+        precision = 4,
+        step = 0.01
+        )
+
+    collision_shape: EnumProperty(
+        name = "Collision Shape",
+        description = "Rigid body collision shape, overridden by object's collision_shape custom property",
+        items = [
+            ("KEEP", "Keep", "Use collision shapes set in the .blend file"),
+            ("CONVEX_HULL", "Convex Hull", "Convex hull of the mesh"),
+            ("BOX", "Box", "Bounding box of the mesh"),
+        ],
+        default = "KEEP"
+        )
+
+    render_passes: EnumProperty(
+        name = "Render Passes",
+        items = [
+            ("TWO_PASS", "Cycles + Eevee", "Render realistic image with Cycles and emission mask with Eevee"),
+            ("OBJECT_INDEX", "Object Index", "Write mask from object index pass of the single Cycles render"),
+        ],
+        default = "TWO_PASS"
+        )
+
+    mask_labeling: EnumProperty(
+        name = "Mask Labeling",
+        description = "How emission masks are labeled (Cycles + Eevee render passes only)",
+        items = [
+            ("FILE", "Write Mask", "Write mask files for labelImages.py"),
+            ("LABEL", "Label in Blender", "Write YOLO labels from mask pixels right after the mask pass, no mask files. In background Blender masks are written as PNG, read back and removed"),
+            ("LABEL_AND_FILE", "Label and Write Mask", "Write YOLO labels from mask pixels and mask files"),
+        ],
+        default = "FILE"
+        )
+
     my_collection : PointerProperty(
         name="Collection",
         type=bpy.types.Collection
@@ -105,6 +263,56 @@ class MyProperties(PropertyGroup):
 def is_child(obj):
     return obj.parent is not None
 
+class ObjectRecord:
+    """Top-level object of the collection with everything the render loop needs per image
+
+    Materials are looked up on first use, so records can be built before setup_materials
+    creates the emission materials, e.g. to plan scenes."""
+    __slots__ = ("obj", "index", "radius", "drop_height", "default_angles", "free_axis", "realistic_material", "emission_material")
+
+    def __init__(self, obj, index):
+        self.obj = obj
+        self.index = index
+        dimensions = obj.dimensions
+        self.radius = dimensions.length / 2
+        self.drop_height = math.sqrt(max(dimensions.x, dimensions.y, dimensions.z))
+        self.default_angles = None
+        self.free_axis = None
+        if 'default_angles' in obj:
+            rx, ry, rz, free_axis = obj['default_angles'][:4]
+            self.default_angles = (rx, ry, rz)
+            self.free_axis = int(free_axis)
+        self.realistic_material = None
+        self.emission_material = None
+
+    def material(self, emission):
+        """Emission or realistic material of the object"""
+        if emission:
+            if self.emission_material is None:
+                self.emission_material = bpy.data.materials["Emission " + str(self.index)]
+            return self.emission_material
+        if self.realistic_material is None:
+            self.realistic_material = bpy.data.materials[self.obj.name + "_MAT"]
+        return self.realistic_material
+
+# Object records of the collection, rebuilt once per run by build_scene_snapshot
+scene_snapshot = None
+
+def build_scene_snapshot():
+    """Build object records of the top-level objects of the collection, return them
+
+    Called once per run, so objects added, removed or edited since the last run are read
+    again and materials recreated by setup_materials are looked up again."""
+    global scene_snapshot
+    collection = bpy.data.collections[bpy.context.scene.my_tool.my_collection.name]
+    top_level = [obj for obj in collection.all_objects if not is_child(obj)]
+    scene_snapshot = [ObjectRecord(obj, index) for index, obj in enumerate(top_level)]
+    return scene_snapshot
+
+def scene_objects():
+    """Object records of the current run, built on first use outside a run"""
+    return scene_snapshot if scene_snapshot is not None else build_scene_snapshot()
+
 def setup_output_folder():
     """Setup output folder with subfolders black and images"""
     mytool = bpy.context.scene.my_tool
@@ -114,6 +322,15 @@ def setup_output_folder():
         os.mkdir(black_folder)
     if not os.path.exists(images_folder):
         os.mkdir(images_folder)
+    labels_folder = mytool.output_path + "labels"
+    labels_needed = mytool.annotation_mode == "PROJECTION" or mytool.mask_labeling != "FILE"
+    if labels_needed and not os.path.exists(labels_folder):
+        os.mkdir(labels_folder)
+
+    # Remove sentinel of previous run so a watching labeler keeps waiting
+    sentinel_path = os.path.join(black_folder, SENTINEL_FILENAME)
+    if os.path.exists(sentinel_path):
+        os.remove(sentinel_path)
 
 def verify_collection():
     """Verify collection and if collection is empty raise error"""
@@ -131,6 +348,51 @@ def setup_gravity():
     scene.gravity = (0,0,-100)
     scene.use_gravity = True
 
+def setup_rigid_bodies():
+    """Set collision shapes of objects and make simulation cache long enough"""
+    scene = bpy.context.scene
+    mytool = scene.my_tool
+    for obj in bpy.data.collections[mytool.my_collection.name].all_objects:
+        if is_child(obj) or not obj.rigid_body:
+            continue
+        collision_shape = obj.get("collision_shape", mytool.collision_shape)
+        if collision_shape != "KEEP":
+            obj.rigid_body.collision_shape = collision_shape
+
+    max_frames = mytool.max_simulation_frames or scene.render.fps
+    if scene.rigidbody_world is not None:
+        point_cache = scene.rigidbody_world.point_cache
+        point_cache.frame_end = max(point_cache.frame_end, max_frames + 1)
+
+def apply_render_profile():
+    """Set Cycles sampling, denoising and performance settings of the render profile, once per run
+
+    With Object Index render passes, persistent data keeps the scene on the render side
+    between images, so only changed transforms are synced instead of rebuilding the BVH and
+    shaders for every image. Cycles + Eevee passes switch engine and materials twice per
+    image, which discards the persistent scene, so there only sampling settings help."""
+    scene = bpy.context.scene
+    mytool = scene.my_tool
+    if mytool.render_profile == "KEEP":
+        return
+    samples, noise_threshold, min_samples = RENDER_PROFILES[mytool.render_profile]
+    scene.render.use_persistent_data = True
+    scene.cycles.samples = samples
+    scene.cycles.use_adaptive_sampling = True
+    scene.cycles.adaptive_threshold = noise_threshold
+    scene.cycles.adaptive_min_samples = min_samples
+    scene.cycles.use_denoising = True
+    scene.cycles.denoiser = "OPENIMAGEDENOISE"
+    scene.cycles.time_limit = mytool.render_time_limit
+    # All cores on one frame, renderFarm.py overrides the thread count with -t
+    scene.render.threads_mode = "AUTO"
+    # Tiles only save memory, whole frame renders fastest on CPU
+    scene.cycles.use_auto_tile = scene.cycles.device == "GPU"
+    print(f"Render profile {mytool.render_profile}: {samples} samples, noise threshold {noise_threshold}, "
+          f"time limit {mytool.render_time_limit or 'none'}, {scene.render.threads} threads")
+    if mytool.render_passes == "TWO_PASS":
+        print("Persistent data is discarded between images by the Eevee mask pass, use Object Index render passes to keep it")
+
 def prepare_environment(renderer: str):
     scene = bpy.context.scene
     mytool = scene.my_tool
@@ -150,123 +412,398 @@ def prepare_environment(renderer: str):
         scene.render.filter_size = 0
         bpy.data.worlds["World"].node_tree.nodes["Background"].inputs[1].default_value = 0
 
+def save_image_settings():
+    """Save output image settings of realistic renders"""
+    image_settings = bpy.context.scene.render.image_settings
+    return {
+        "file_format": image_settings.file_format,
+        "color_mode": image_settings.color_mode,
+        "color_depth": image_settings.color_depth,
+    }
+
+def restore_image_settings(settings):
+    """Restore output image settings saved with save_image_settings"""
+    image_settings = bpy.context.scene.render.image_settings
+    for name, value in settings.items():
+        setattr(image_settings, name, value)
+
+def set_foreground_image_settings():
+    """Set output image settings of transparent renders, return file extension"""
+    image_settings = bpy.context.scene.render.image_settings
+    image_settings.file_format = "PNG"
+    image_settings.color_mode = "RGBA"
+    image_settings.color_depth = "8"
+    return ".png"
+
+def set_mask_image_settings(mask_format: str):
+    """Set lossless output image settings for mask renders, return mask file extension"""
+    image_settings = bpy.context.scene.render.image_settings
+    file_format, color_depth, extension = MASK_FORMATS[mask_format]
+    image_settings.file_format = file_format
+    image_settings.color_mode = "RGB"
+    if color_depth is not None:
+        image_settings.color_depth = color_depth
+    if file_format == "PNG":
+        image_settings.compression = 0
+    elif file_format == "OPEN_EXR":
+        image_settings.exr_codec = "NONE"
+    return extension
+
 def materialize_objects(material: str):
-    """Clear object materials and append material"""
-    mytool = bpy.context.scene.my_tool
-    index = 0
-    for obj in bpy.data.collections[mytool.my_collection.name].all_objects:
-        if is_child(obj):
-            continue
-        obj.data.materials.clear()
-        material_name = ""
-        if material == "Emission":
-            material_name = "Emission " + str(index)
-        elif material == "Realistic":
-            material_name = obj.name + "_MAT"
+    """Give every object only the material"""
+    if material not in ("Emission", "Realistic"):
+        raise ValueError("ERROR DEFINING MATERIAL")
+    emission = material == "Emission"
+    for record in scene_objects():
+        materials = record.obj.data.materials
+        new_material = record.material(emission)
+        if len(materials) == 1:
+            materials[0] = new_material
         else:
-            raise ValueError("ERROR DEFINING MATERIAL")
-
-        obj.data.materials.append(bpy.data.materials[material_name])
-        index += 1
+            materials.clear()
+            materials.append(new_material)
 
 def place_objects():
     """Foreach object in collection define object's location"""
-    mytool = bpy.context.scene.my_tool
-    index = 0
-    for obj in bpy.data.collections[mytool.my_collection.name].all_objects:
-        if is_child(obj):
-            continue
+    max_offset = bpy.context.scene.my_tool.max_offset
+    for record in scene_objects():
         angle = random.uniform(0, math.radians(360))
-        r = random.uniform(0, mytool.max_offset)
+        r = random.uniform(0, max_offset)
         x = r * math.cos(angle)
         y = r * math.sin(angle)
-        dimensions = obj.dimensions
-        distance = math.sqrt(max(dimensions.x, dimensions.y, dimensions.z))
-        z = distance
-        obj.location = x, y, z
-        index += 1
+        record.obj.location = x, y, record.drop_height
 
 def rotate_objects():
-    """Foreach object in collection define object's rotation"""
-    mytool = bpy.context.scene.my_tool
-    for obj in bpy.data.collections[mytool.my_collection.name].all_objects:
-        if is_child(obj):
-            continue
+    """Foreach object in collection define object's rotation
+
+    Objects without default angles are always rotated randomly, like in scenePlanner."""
+    for record in scene_objects():
         rng = random.randint(0,1)
-        if rng == 0:
+        if rng == 0 or record.default_angles is None:
             rx = random.randint(0, 359)
             ry = random.randint(0, 359)
             rz = random.randint(0, 359)
             rotation = [rx, ry, rz]
         else:
-            f_axis = obj['default_angles'][3]
-            rx = obj['default_angles'][0]
-            ry = obj['default_angles'][1]
-            rz = obj['default_angles'][2]
-            rotation = [rx, ry, rz]
-            rotation[f_axis] = random.randint(0, 359)
+            rotation = list(record.default_angles)
+            rotation[record.free_axis] = random.randint(0, 359)
 
         rx = math.radians(rotation[0])
         ry = math.radians(rotation[1])
         rz = math.radians(rotation[2])
-        obj.rotation_euler = (rx, ry, rz)
+        record.obj.rotation_euler = (rx, ry, rz)
 
-def simulate():
+def object_specs():
+    """Bounding sphere radius, drop height and default angles of every object in collection"""
+    objects = build_scene_snapshot()
+    radii = [record.radius for record in objects]
+    drop_heights = [record.drop_height for record in objects]
+    default_angles = [None if record.default_angles is None else (*record.default_angles, record.free_axis) for record in objects]
+    return radii, drop_heights, default_angles
+
+def write_scene_plan(seed=None):
+    """Plan object locations and rotations of all images and save plan to plan path"""
     mytool = bpy.context.scene.my_tool
+    radii, drop_heights, default_angles = object_specs()
+    plan, overlapping = scenePlanner.make_plan(seed, mytool.image_offset, mytool.number_of_images,
+                                               radii, drop_heights, default_angles, mytool.max_offset)
+    scenePlanner.save_plan(bpy.path.abspath(mytool.plan_path), plan)
+    if overlapping:
+        print(f"{overlapping} objects could not be placed without overlapping")
+
+def apply_scene_plan(plan, image):
+    """Foreach object in collection set location and rotation from plan"""
+    locations, rotations = scenePlanner.plan_entry(plan, image)
+    for index, record in enumerate(scene_objects()):
+        record.obj.location = locations[index]
+        record.obj.rotation_euler = rotations[index]
+
+def simulate():
+    """Step rigid body simulation until objects settle or max frames, return number of frames simulated"""
+    scene = bpy.context.scene
+    mytool = scene.my_tool
     bpy.ops.object.select_all(action='DESELECT')
 
-    for obj in bpy.data.collections[mytool.my_collection.name].objects:
-        if not obj.rigid_body:
-            continue
+    bodies = [record.obj for record in scene_objects() if record.obj.rigid_body]
     
-    bpy.context.scene.frame_end = 1 * bpy.context.scene.render.fps # x secs
+    max_frames = mytool.max_simulation_frames or scene.render.fps # 1 sec
+    scene.frame_end = max_frames
 
-    bpy.context.scene.frame_set(1)
-    bpy.ops.screen.animation_play()
-    for i in range(bpy.context.scene.frame_end):
-        bpy.context.scene.frame_set(bpy.context.scene.frame_current + 1)
+    scene.frame_set(1)
+    if not bpy.app.background:
+        bpy.ops.screen.animation_play()
 
-def render_scene():
-    """Position, rotate object and make render"""
+    previous = np.array([obj.matrix_world for obj in bodies])
+    still_frames = 0
+    frames = 0
+    for frames in range(1, max_frames + 1):
+        scene.frame_set(scene.frame_current + 1)
+        current = np.array([obj.matrix_world for obj in bodies])
+        if np.abs(current - previous).max(initial=0) < mytool.settle_threshold:
+            still_frames += 1
+            if still_frames >= SETTLE_FRAMES:
+                break
+        else:
+            still_frames = 0
+        previous = current
+    return frames
+
+def object_world_vertices(obj, depsgraph):
+    """Vertices of object's evaluated mesh in world coordinates"""
+    obj_eval = obj.evaluated_get(depsgraph)
+    mesh = obj_eval.to_mesh()
+    vertices = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+    mesh.vertices.foreach_get("co", vertices)
+    obj_eval.to_mesh_clear()
+    matrix = np.array(obj_eval.matrix_world)
+    return vertices.reshape(-1, 3) @ matrix[:3, :3].T + matrix[:3, 3]
+
+def project_objects():
+    """Project objects in collection onto the camera frame, return image width, height and boxes"""
+    scene = bpy.context.scene
+    depsgraph = bpy.context.evaluated_depsgraph_get()
+    camera = scene.camera
+
+    objects_vertices = [(index, object_world_vertices(record.obj, depsgraph)) for index, record in enumerate(scene_objects())]
+
+    width = int(scene.render.resolution_x * scene.render.resolution_percentage / 100)
+    height = int(scene.render.resolution_y * scene.render.resolution_percentage / 100)
+    view_frame = [tuple(corner) for corner in camera.data.view_frame(scene=scene)]
+    objects_info = bboxProjection.project_boxes(objects_vertices, np.array(camera.matrix_world), view_frame,
+                                                width, height, camera.data.type == "ORTHO")
+    return width, height, objects_info
+
+def label_from_projection(offset):
+    """Write YOLO label of projected objects unless they may occlude each other, return True if written"""
+    mytool = bpy.context.scene.my_tool
+    width, height, objects_info = project_objects()
+    if bboxProjection.boxes_overlap(objects_info):
+        return False
+    label_path = os.path.join(mytool.output_path, "labels", "render%d.txt" % offset)
+    bboxProjection.write_yolo_label(label_path, width, height, objects_info)
+    return True
+
+def setup_mask_viewer():
+    """Link render to a compositor Viewer node, its image holds the pixels of the last render"""
+    compositor = bpy.context.scene.node_tree
+    if "mask_viewer_node" not in compositor.nodes.keys():
+        viewer_node = compositor.nodes.new(type="CompositorNodeViewer")
+        viewer_node.name = "mask_viewer_node"
+        viewer_node.location = (600, -300)
+    viewer_node = compositor.nodes["mask_viewer_node"]
+    viewer_node.use_alpha = False
+    compositor.links.new(compositor.nodes["Render Layers"].outputs[0], viewer_node.inputs[0])
+    compositor.nodes.active = viewer_node
+
+def label_from_render(offset, buffer, num_objects, palette, mask_path=None):
+    """Write YOLO label of the last mask render, return pixel buffer
+
+    Pixels come from the Viewer node image, or from the mask file at mask_path in background
+    Blender, whose compositor does not run Viewer nodes. They are copied with foreach_get into
+    buffer, which is reused while the size stays the same. Masks render without view
+    transform, so values are the emission colors."""
+    mytool = bpy.context.scene.my_tool
+    if mask_path is None:
+        mask_image = bpy.data.images["Viewer Node"]
+    else:
+        mask_image = bpy.data.images.load(mask_path, check_existing=False)
+        # Keep 16 bit and float masks as written instead of converting them to linear
+        mask_image.colorspace_settings.name = "Non-Color"
+    width, height = mask_image.size
+    channels = mask_image.channels
+    if buffer is None or buffer.size != width * height * channels:
+        buffer = np.empty(width * height * channels, dtype=np.float32)
+    mask_image.pixels.foreach_get(buffer)
+    if mask_path is not None:
+        bpy.data.images.remove(mask_image)
+    # Blender rows go bottom up, RGB(A) to BGR like the labeler reads files
+    image = buffer.reshape(height, width, channels)[::-1, :, 2::-1]
+    width, height, objects_info = maskLabeling.label_array(image, num_objects, stride=1, palette=palette)
+    label_path = os.path.join(mytool.output_path, "labels", "render%d.txt" % offset)
+    bboxProjection.write_yolo_label(label_path, width, height, objects_info)
+    return buffer
+
+def set_pass_index(obj, index):
+    """Set pass index of object and all its children"""
+    obj.pass_index = index
+    for child in obj.children:
+        set_pass_index(child, index)
+
+def setup_index_output():
+    """Write object index pass of every render as mask, when Render Passes is Object Index
+
+    Top-level objects get pass index 1..n, which is divided by n so the mask matches the
+    emission palette. The mask is written by a compositor File Output node as EXR."""
     scene = bpy.context.scene
     mytool = scene.my_tool
+    scene.use_nodes = True
+    compositor = scene.node_tree
+    node_names = {"index_scale_node": "CompositorNodeMath", "index_output_node": "CompositorNodeOutputFile"}
+
+    if mytool.render_passes != "OBJECT_INDEX":
+        for name in node_names:
+            if name in compositor.nodes:
+                compositor.nodes.remove(compositor.nodes[name])
+        return
+
+    objects = scene_objects()
+    number_of_objects = len(objects)
+    for index, record in enumerate(objects, 1):
+        set_pass_index(record.obj, index)
+    bpy.context.view_layer.use_pass_object_index = True
+
+    for name, type in node_names.items():
+        if name not in compositor.nodes:
+            node = compositor.nodes.new(type=type)
+            node.name = name
+    render_layers_node = next(node for node in compositor.nodes if node.type == "R_LAYERS")
+
+    index_scale_node = compositor.nodes["index_scale_node"]
+    index_scale_node.operation = "DIVIDE"
+    index_scale_node.inputs[1].default_value = number_of_objects
+
+    index_output_node = compositor.nodes["index_output_node"]
+    index_output_node.base_path = os.path.join(mytool.output_path, "black")
+    index_output_node.format.file_format = "OPEN_EXR"
+    index_output_node.format.color_mode = "BW"
+    index_output_node.format.color_depth = "16"
+    index_output_node.format.exr_codec = "NONE"
+
+    compositor.links.new(render_layers_node.outputs["IndexOB"], index_scale_node.inputs[0])
+    compositor.links.new(index_scale_node.outputs[0], index_output_node.inputs[0])
+
+def set_index_output_path(offset):
+    """Point index output node to mask of image, File Output appends frame number to it"""
+    index_output_node = bpy.context.scene.node_tree.nodes["index_output_node"]
+    index_output_node.file_slots[0].path = "render%d_" % offset
+
+def rename_index_output(offset):
+    """Remove frame number File Output node added to mask filename"""
+    scene = bpy.context.scene
+    black_folder = os.path.join(scene.my_tool.output_path, "black")
+    written_path = os.path.join(black_folder, "render%d_%04d.exr" % (offset, scene.frame_current))
+    os.replace(written_path, os.path.join(black_folder, "render%d.exr" % offset))
+
+def render_scene(seed=None, on_image_done=None, write_sentinel=True):
+    """Position, rotate object and make render
+
+    With seed, randomness of every image depends only on seed and image number, so a
+    range of images can be rendered again or continued with the same result. With a
+    scene plan, objects are placed as planned instead.
+    on_image_done is called with image number after each image."""
+    scene = bpy.context.scene
+    mytool = scene.my_tool
+    realistic_settings = save_image_settings()
+    plan = scenePlanner.load_plan(bpy.path.abspath(mytool.plan_path)) if mytool.plan_path else None
+    single_pass = mytool.render_passes == "OBJECT_INDEX"
+    if single_pass:
+        # Engine and materials stay the same for the whole run
+        prepare_environment("CYCLES")
+        materialize_objects("Realistic")
+    apply_render_profile()
+    label_masks = not single_pass and mytool.mask_labeling != "FILE"
+    keep_masks = mytool.mask_labeling != "LABEL"
+    # Background Blender does not run Viewer nodes, masks are labeled from their files there
+    read_mask_files = label_masks and bpy.app.background
+    # Masks written only to be labeled are lossless PNG and removed after labeling
+    mask_format = mytool.mask_format if keep_masks else "PNG"
+    if label_masks:
+        if not read_mask_files:
+            setup_mask_viewer()
+        num_objects = len(scene_objects())
+        # Written by setup_materials when masks use RGB ids
+        palette_path = os.path.join(mytool.output_path, "black", maskPalette.PALETTE_FILENAME)
+        palette = maskPalette.load_palette(palette_path) if os.path.exists(palette_path) else None
+        mask_buffer = None
     
     for image in range(mytool.number_of_images):
-        # Set objects location and rotation
-        place_objects()
-        rotate_objects()
-        simulate()
-        
         offset = mytool.image_offset + image
+        if seed is not None:
+            random.seed(f"{seed}:{offset}")
 
-        # Render realistic
-        prepare_environment("CYCLES")
-        materialize_objects("Realistic")
-        output_file_pattern_string = 'images/render%d.jpg'
-        scene.render.filepath = os.path.join(mytool.output_path, (output_file_pattern_string % offset))
-        bpy.ops.render.render(write_still = True)
+        image_name = "render%d" % offset
 
-        # Render black
-        prepare_environment("BLENDER_EEVEE")
-        materialize_objects("Emission")
-        output_file_pattern_string = 'black/render%d.jpg'
+        # Set objects location and rotation
+        with stageTimer.stage("place", image_name):
+            if plan is not None:
+                apply_scene_plan(plan, offset)
+            else:
+                place_objects()
+                rotate_objects()
+        with stageTimer.stage("simulate", image_name):
+            frames = simulate()
+        render_start = time.perf_counter()
+
+        # Render realistic, in single pass mode compositor writes the mask too
+        if not single_pass:
+            prepare_environment("CYCLES")
+            materialize_objects("Realistic")
+        restore_image_settings(realistic_settings)
+        image_extension = ".jpg"
+        if mytool.background_mode == "TRANSPARENT":
+            image_extension = set_foreground_image_settings()
+        if single_pass:
+            set_index_output_path(offset)
+        output_file_pattern_string = 'images/render%d' + image_extension
         scene.render.filepath = os.path.join(mytool.output_path, (output_file_pattern_string % offset))
-        bpy.ops.render.render(write_still = True)
+        cycles_start = time.perf_counter()
+        with stageTimer.stage("render_image", image_name):
+            bpy.ops.render.render(write_still = True)
+        cycles_time = time.perf_counter() - cycles_start
+
+        if single_pass:
+            with stageTimer.stage("write_mask", image_name):
+                rename_index_output(offset)
+        else:
+            projected = False
+            if mytool.annotation_mode == "PROJECTION":
+                with stageTimer.stage("project", image_name):
+                    projected = label_from_projection(offset)
+            if not projected:
+                # Render black
+                with stageTimer.stage("render_mask", image_name):
+                    prepare_environment("BLENDER_EEVEE")
+                    materialize_objects("Emission")
+                    mask_extension = set_mask_image_settings(mask_format)
+                    output_file_pattern_string = 'black/render%d' + mask_extension
+                    scene.render.filepath = os.path.join(mytool.output_path, (output_file_pattern_string % offset))
+                    bpy.ops.render.render(write_still = keep_masks or read_mask_files)
+                if label_masks:
+                    with stageTimer.stage("label_mask", image_name):
+                        mask_path = bpy.path.abspath(scene.render.filepath) if read_mask_files else None
+                        mask_buffer = label_from_render(offset, mask_buffer, num_objects, palette, mask_path)
+                        if mask_path is not None and not keep_masks:
+                            os.remove(mask_path)
+        print(f"Image {offset} simulated {frames} frames, rendered in {time.perf_counter() - render_start:.2f} s "
+              f"(Cycles {cycles_time:.2f} s, profile {mytool.render_profile})")
+
+        if not bpy.app.background:
+            bpy.ops.screen.animation_cancel(restore_frame=True)
+        if on_image_done is not None:
+            on_image_done(offset)
 
-        bpy.ops.screen.animation_cancel(restore_frame=True)
+    # Tell watching labeler that all masks are written
+    if write_sentinel:
+        open(os.path.join(mytool.output_path, "black", SENTINEL_FILENAME), "w").close()
             
     # Set normal color mode
+    restore_image_settings(realistic_settings)
     prepare_environment("CYCLES")
     materialize_objects("Realistic")
     
 def setup_background():
-    """Make background image on render"""
+    """Make background image on render, or leave it transparent for compositeBackgrounds.py"""
 
     # General settings
     bpy.context.scene.render.film_transparent = True
     bpy.context.scene.use_nodes = True
     compositor = bpy.context.scene.node_tree
 
+    if bpy.context.scene.my_tool.background_mode == "TRANSPARENT":
+        # Bypass alpha over, render keeps its alpha and shadow catcher shadows
+        compositor.links.new(compositor.nodes["Render Layers"].outputs[0], compositor.nodes["Composite"].inputs[0])
+        return
+
     # Get background image struct
     active_cam = bpy.context.scene.camera.name
     bg_images = bpy.data.objects[active_cam].data.background_images.items()
@@ -351,10 +888,21 @@ def setup_materials():
     scene = bpy.context.scene
     mytool = scene.my_tool
 
-    number_of_objects = 0
+    object_classes = []
     for obj in bpy.data.collections[mytool.my_collection.name].all_objects:
         if not is_child(obj):
-            number_of_objects += 1
+            object_classes.append(obj.get("class_index", len(object_classes)))
+    number_of_objects = len(object_classes)
+
+    rgb_id = mytool.mask_palette == "RGB_ID" and mytool.render_passes == "TWO_PASS"
+    palette_path = os.path.join(mytool.output_path, "black", maskPalette.PALETTE_FILENAME)
+    if rgb_id and mytool.mask_format == "JPEG":
+        raise ValueError("RGB ID mask palette needs a lossless mask format, JPEG changes the colors")
+    if rgb_id:
+        maskPalette.save_palette(palette_path, maskPalette.make_palette(object_classes))
+    elif os.path.exists(palette_path):
+        # labelImages.py would decode red masks with the palette of an earlier run
+        os.remove(palette_path)
     
     # Remove all materials that are not _MAT
     for material in bpy.data.materials:
@@ -366,8 +914,12 @@ def setup_materials():
     for i in range(number_of_objects):
         emmision_mat = bpy.data.materials.new(name="Emission "+ str(i))
         emmision_mat.use_nodes = True
-        r = (i+1) * (255 / number_of_objects)
-        rgb_color = (r/255, 0, 0, 1)
+        if rgb_id:
+            r, g, b = maskPalette.id_color(i+1)
+            rgb_color = (r/255, g/255, b/255, 1)
+        else:
+            r = (i+1) * (255 / number_of_objects)
+            rgb_color = (r/255, 0, 0, 1)
         emmision_mat.node_tree.nodes["Principled BSDF"].inputs["Emission"].default_value = rgb_color
         emmision_mat.node_tree.nodes["Principled BSDF"].inputs["Specular"].default_value = 0
         emmision_mat.node_tree.nodes["Principled BSDF"].inputs["Subsurface Radius"].default_value = (0, 0, 0)
@@ -377,6 +929,27 @@ def setup_materials():
         emmision_mat.node_tree.nodes["Principled BSDF"].inputs["Clearcoat Roughness"].default_value = 0
         emmision_mat.node_tree.nodes["Principled BSDF"].inputs["IOR"].default_value = 0
     
+def generate(seed=None, on_image_done=None, write_sentinel=True):
+    """Prepare scene and render all images, see render_scene for arguments"""
+    timings_path = bpy.context.scene.my_tool.timings_path
+    if timings_path:
+        stageTimer.enable(bpy.path.abspath(timings_path))
+    else:
+        stageTimer.disable()
+    verify_collection()
+    setup_output_folder()
+    setup_gravity()
+    setup_rigid_bodies()
+    setup_materials()
+    build_scene_snapshot()
+    setup_shadow_catcher()
+    setup_background()
+    setup_index_output()
+    mytool = bpy.context.scene.my_tool
+    if mytool.plan_path and not os.path.exists(bpy.path.abspath(mytool.plan_path)):
+        write_scene_plan(seed)
+    render_scene(seed, on_image_done, write_sentinel)
+
 # ------------------------------------------------------------------------
 #    Operators
 # ------------------------------------------------------------------------
@@ -388,13 +961,7 @@ class WM_OT_ExecuteButton(Operator):
     # On click
     def execute(self, context):
 
-        verify_collection()
-        setup_output_folder()
-        setup_gravity()
-        setup_materials()
-        setup_shadow_catcher()
-        setup_background()
-        render_scene()
+        generate()
         
         return {'FINISHED'}
 
@@ -428,6 +995,19 @@ class OBJECT_PT_CustomPanel(Panel):
         layout.prop(mytool, "number_of_images")
         layout.prop(mytool, "my_collection")
         layout.prop(mytool, "output_path")
+        layout.prop(mytool, "plan_path")
+        layout.prop(mytool, "timings_path")
+        layout.prop(mytool, "render_profile")
+        layout.prop(mytool, "render_time_limit")
+        layout.prop(mytool, "background_mode")
+        layout.prop(mytool, "mask_format")
+        layout.prop(mytool, "mask_palette")
+        layout.prop(mytool, "mask_labeling")
+        layout.prop(mytool, "annotation_mode")
+        layout.prop(mytool, "render_passes")
+        layout.prop(mytool, "max_simulation_frames")
+        layout.prop(mytool, "settle_threshold")
+        layout.prop(mytool, "collision_shape")
         layout.prop(mytool, "image_offset")
         layout.operator("wm.execute_button")
 
@@ -1,59 +1,147 @@
-import cv2
 import os
-from multiprocessing import Pool
+# OpenCV reads EXR masks only when enabled before it is imported
+os.environ.setdefault("OPENCV_IO_ENABLE_OPENEXR", "1")
+import cv2
+import functools
+import hashlib
+import json
+import numpy as np
+import sqlite3
+import struct
+import time
+from multiprocessing import Pool, Process, Queue
 import argparse
+from xml.etree import ElementTree
+
+import maskPalette
+import stageTimer
+from maskLabeling import (red_channel, to_uint8, value_extents, find_objects, class_index_lut, class_index_map,
+                          index_map_boxes, split_instances, find_object_instances, find_palette_objects, label_array)
+
+# Must cover every extension in MASK_FORMATS of the addon, or watch mode never picks up its masks
+MASK_EXTENSIONS = ('.png', '.bmp', '.exr', '.npy', '.jpg')
+DECODERS = ("full", "red", "reduced2", "reduced4", "raw")
+SENTINEL_FILENAME = ".done"
+MANIFEST_FILENAME = "manifest.sqlite"
+COCO_FILENAME = "annotations.json"
+FORMATS = {"yolo": ("yolo",), "coco": ("coco",), "voc": ("voc",), "all": ("yolo", "coco", "voc")}
+LABEL_EXTENSIONS = {"yolo": ".txt", "voc": ".xml"}
+SEGMENT_OPTIONS = {"none": (), "polygon": ("polygon",), "rle": ("rle",), "all": ("polygon", "rle")}
+
+def read_bmp_red(image_path):
+    """Map red channel of an uncompressed 24 or 32 bit BMP file without decoding, None for other BMP files"""
+    with open(image_path, "rb") as file:
+        header = file.read(34)
+    if len(header) < 34 or header[:2] != b"BM":
+        return None
+    pixel_offset, = struct.unpack_from("<I", header, 10)
+    width, height, planes, bits, compression = struct.unpack_from("<iiHHI", header, 18)
+    if bits not in (24, 32) or compression != 0:
+        return None
+    channels = bits // 8
+    row_size = (bits * width + 31) // 32 * 4
+    rows = np.memmap(image_path, dtype=np.uint8, mode="r", offset=pixel_offset, shape=(abs(height), row_size))
+    red = rows[:, 2:width * channels:channels]
+    return red[::-1] if height > 0 else red
+
+def read_mask(image_path, decode="full"):
+    """Read red channel of mask image, return it with the factor its coordinates are scaled down by
+
+    full decodes all channels, red keeps only the red channel after decoding, reduced2 and
+    reduced4 let the decoder scale the image down (fast for JPEG, but edges of objects are
+    blended) and raw maps uncompressed BMP files without decoding. Format is detected from
+    the extension: .npy arrays are always memory mapped and 16 bit PNG and float EXR masks
+    are scaled to 0-255."""
+    if image_path.endswith(".npy"):
+        return to_uint8(red_channel(np.load(image_path, mmap_mode="r"))), 1
+    if image_path.endswith(".exr"):
+        image = cv2.imread(image_path, cv2.IMREAD_ANYCOLOR | cv2.IMREAD_ANYDEPTH)
+        return (None if image is None else to_uint8(red_channel(image))), 1
+
+    if decode == "raw":
+        if image_path.endswith(".bmp"):
+            red = read_bmp_red(image_path)
+            if red is not None:
+                return red, 1
+        decode = "red"
 
-def process_image(image_path, dest_folder, num_objects):
-    image = cv2.imread(image_path)
+    if decode == "reduced2":
+        image, scale = cv2.imread(image_path, cv2.IMREAD_REDUCED_COLOR_2), 2
+    elif decode == "reduced4":
+        image, scale = cv2.imread(image_path, cv2.IMREAD_REDUCED_COLOR_4), 4
+    elif decode == "red":
+        image, scale = cv2.imread(image_path, cv2.IMREAD_UNCHANGED), 1
+        if image is not None and image.ndim == 3:
+            image = cv2.extractChannel(image, 2)
+    else:
+        image, scale = cv2.imread(image_path), 1
     if image is None:
+        return None, scale
+    return to_uint8(red_channel(image)), scale
+
+def read_mask_color(image_path):
+    """Read all channels of mask image as 8 bit BGR"""
+    if image_path.endswith(".npy"):
+        return to_uint8(np.load(image_path, mmap_mode="r"))
+    image = cv2.imread(image_path, cv2.IMREAD_COLOR | cv2.IMREAD_ANYDEPTH)
+    return None if image is None else to_uint8(image)
+
+def label_image(image_path, num_objects, stride=2, mode="boxes", min_area=0, fragment_ratio=0, decode="full", palette_path=None, segments=(), tolerance=1.0):
+    """Load mask image and find its objects, return image width, height and objects
+
+    Images decoded at reduced resolution are sampled with a stride reduced by the same
+    factor and coordinates are scaled back to full resolution. With palette_path, the mask is
+    decoded with the RGB palette in that file (decode is ignored) instead of the red channel.
+    segments ("polygon", "rle") of every object are added as "segmentation", RLE needs a
+    full resolution decode."""
+    if palette_path:
+        with stageTimer.stage("decode", image_path):
+            image = read_mask_color(image_path)
+        if image is None:
+            print(f"Error loading the image: {image_path}")
+            return
+        with stageTimer.stage("scan", image_path):
+            return label_array(image, num_objects, stride, mode, min_area, fragment_ratio, load_palette(palette_path), segments, tolerance)
+
+    # Memory-mapped masks (.npy, uncompressed .bmp) are paged in while scanning
+    with stageTimer.stage("decode", image_path):
+        red, scale = read_mask(image_path, decode)
+    if red is None:
         print(f"Error loading the image: {image_path}")
         return
-    height, width, channels = image.shape
-
-    left_list = []
-    right_list = []
-    top_list = []
-    bottom_list = []
-
-    objects_found = []
-    delta_red = 255 / num_objects
-
-    for object_index in range(num_objects):
-        object_red_channel = (object_index + 1) * delta_red
-        top, bottom, left, right = height, 0, width, 0
-        found = False
-
-        for y in range(0, height, 2):
-            for x in range(0, width, 2):
-                b, g, r = image[y, x]
-                if object_red_channel - 1 <= r <= object_red_channel + 1:
-                    found = True
-                    top = min(top, y)
-                    bottom = max(bottom, y)
-                    left = min(left, x)
-                    right = max(right, x)
-
-        if found:
-            objects_found.append(object_index)
-        left_list.append(left)
-        right_list.append(right)
-        top_list.append(top)
-        bottom_list.append(bottom)
-    
-    objects_info = [
-        {
-            "index": i,
-            "xmin": left_list[i],
-            "xmax": right_list[i],
-            "ymin": top_list[i],
-            "ymax": bottom_list[i],
-        }
-        for i in objects_found
-    ]
-    create_annotation_txt(image_path, dest_folder, width, height, objects_info)
+    sample_stride = max(1, stride // scale)
+
+    with stageTimer.stage("scan", image_path):
+        width, height, objects_info = label_array(red, num_objects, sample_stride, mode, min_area / scale ** 2, fragment_ratio,
+                                                  segments=segments, tolerance=tolerance / scale)
+    if scale > 1:
+        for obj in objects_info:
+            for key in ("xmin", "xmax", "ymin", "ymax"):
+                obj[key] *= scale
+            if "segmentation" in obj:
+                obj["segmentation"]["area"] *= scale ** 2
+                obj["segmentation"]["polygon"] = [[x * scale, y * scale] for x, y in obj["segmentation"]["polygon"]]
+    return width * scale, height * scale, objects_info
+
+def process_image(image_path, dest_folder, num_objects, stride=2, mode="boxes", min_area=0, fragment_ratio=0, decode="full", palette_path=None, segments=(), tolerance=1.0, formats=("yolo",), image_extension=None, class_names=None):
+    """Label image and write its YOLO and/or VOC label file, return image width, height and objects"""
+    annotation = label_image(image_path, num_objects, stride, mode, min_area, fragment_ratio, decode, palette_path, segments, tolerance)
+    if annotation is None:
+        return
+    width, height, objects_info = annotation
+    with stageTimer.stage("write", image_path):
+        if "yolo" in formats:
+            create_annotation_txt(image_path, dest_folder, width, height, objects_info)
+        if "voc" in formats:
+            create_annotation_xml(image_path, dest_folder, width, height, objects_info, class_names, image_extension)
+    return annotation
 
 def process_image_wrapper(args):
-    return process_image(*args)
+    return args[0], process_image(*args)
+
+def label_image_wrapper(args):
+    image_path, dest_folder, *options, formats, image_extension, class_names = args
+    return image_path, label_image(image_path, *options)
 
 def create_annotation_txt(image_path, dest_folder, image_width, image_height, objects):
     image_folder, image_filename = os.path.split(image_path)
@@ -61,7 +149,7 @@ def create_annotation_txt(image_path, dest_folder, image_width, image_height, ob
     label_path = os.path.join(dest_folder, label_filename)
 
     with open(label_path, "w") as file:
-        data = ""
+        lines = []
         for obj in objects:
             left = obj["xmin"]
             right = obj["xmax"]
@@ -69,6 +157,13 @@ def create_annotation_txt(image_path, dest_folder, image_width, image_height, ob
             bottom = obj["ymax"]
             index = obj["index"]
 
+            polygon = obj.get("segmentation", {}).get("polygon")
+            if polygon:
+                # YOLO segmentation line: class and normalized outline points
+                points = " ".join(f"{x / image_width} {y / image_height}" for x, y in polygon)
+                lines.append(f"{index} {points} \n")
+                continue
+
             centerX = (right + left) / 2
             centerY = (top + bottom) / 2
             relCenterX = centerX / image_width
@@ -79,33 +174,471 @@ def create_annotation_txt(image_path, dest_folder, image_width, image_height, ob
             relWidth = width / image_width
             relHeight = height / image_height
 
-            data += f"{index} {relCenterX} {relCenterY} {relWidth} {relHeight} \n"
-        file.write(data)
+            lines.append(f"{index} {relCenterX} {relCenterY} {relWidth} {relHeight} \n")
+        file.write("".join(lines))
+    return label_path
+
+def rendered_image_name(mask_name, image_extension=None):
+    """Filename of the rendered image of a mask, same stem in the images folder"""
+    if image_extension is None:
+        return mask_name
+    return os.path.splitext(mask_name)[0] + image_extension
+
+def create_annotation_xml(image_path, dest_folder, image_width, image_height, objects, class_names=None, image_extension=None):
+    """Write Pascal VOC annotation, boxes use 1-based inclusive pixel coordinates
+
+    Objects are named by class_names, by class index when no names are given. The filename
+    is the rendered image's, see rendered_image_name."""
+    image_folder, image_filename = os.path.split(image_path)
+    label_filename = os.path.splitext(image_filename)[0] + ".xml"
+    label_path = os.path.join(dest_folder, label_filename)
+
+    annotation = ElementTree.Element("annotation")
+    ElementTree.SubElement(annotation, "filename").text = rendered_image_name(image_filename, image_extension)
+    size = ElementTree.SubElement(annotation, "size")
+    ElementTree.SubElement(size, "width").text = str(image_width)
+    ElementTree.SubElement(size, "height").text = str(image_height)
+    ElementTree.SubElement(size, "depth").text = "3"
+    for obj in objects:
+        element = ElementTree.SubElement(annotation, "object")
+        ElementTree.SubElement(element, "name").text = class_names[obj["index"]] if class_names else str(obj["index"])
+        ElementTree.SubElement(element, "difficult").text = "0"
+        box = ElementTree.SubElement(element, "bndbox")
+        for key in ("xmin", "ymin", "xmax", "ymax"):
+            ElementTree.SubElement(box, key).text = str(obj[key] + 1)
+    ElementTree.ElementTree(annotation).write(label_path)
+    return label_path
+
+def write_coco_json(annotations, classes, coco_path, image_extension=None):
+    """Stream (mask name, width, height, objects) tuples to a COCO instances file
+
+    Images are written while annotations are spooled to a temporary file and appended
+    afterwards, so only one image is held in memory. Category ids are class index + 1.
+    file_name is the rendered image's, see rendered_image_name."""
+    spool_path = coco_path + ".annotations.tmp"
+    with open(coco_path + ".tmp", "w") as file, open(spool_path, "w+") as spool:
+        file.write('{"categories": ')
+        json.dump([{"id": i + 1, "name": name} for i, name in enumerate(classes)], file)
+        file.write(', "images": [')
+        annotation_id = 0
+        for image_id, (name, width, height, objects_info) in enumerate(annotations, 1):
+            file.write(("," if image_id > 1 else "") + json.dumps({"id": image_id, "file_name": rendered_image_name(name, image_extension), "width": width, "height": height}))
+            for obj in objects_info:
+                annotation_id += 1
+                box_width = obj["xmax"] - obj["xmin"] + 1
+                box_height = obj["ymax"] - obj["ymin"] + 1
+                coco_annotation = {
+                    "id": annotation_id,
+                    "image_id": image_id,
+                    "category_id": obj["index"] + 1,
+                    "bbox": [obj["xmin"], obj["ymin"], box_width, box_height],
+                    "area": box_width * box_height,
+                    "iscrowd": 0,
+                }
+                segmentation = obj.get("segmentation")
+                if segmentation:
+                    coco_annotation["area"] = segmentation["area"]
+                    if "rle" in segmentation:
+                        coco_annotation["segmentation"] = segmentation["rle"]
+                    else:
+                        coco_annotation["segmentation"] = [[coordinate for point in segmentation["polygon"] for coordinate in point]]
+                spool.write(("," if annotation_id > 1 else "") + json.dumps(coco_annotation))
+        file.write('], "annotations": [')
+        spool.seek(0)
+        for chunk in iter(lambda: spool.read(1 << 20), ""):
+            file.write(chunk)
+        file.write("]}")
+    os.remove(spool_path)
+    os.replace(coco_path + ".tmp", coco_path)
+
+class ShardWriter:
+    """Collect annotations of many images and write them to numbered .npz shards in dest folder
+
+    Every shard holds an image table (name, width, height, number of objects) and an object
+    table (class, xmin, xmax, ymin, ymax) in image order. Shards are written to a temporary
+    file first and renamed, so a shard is either complete or missing."""
+
+    def __init__(self, dest_folder, shard_size):
+        self.dest_folder = dest_folder
+        self.shard_size = shard_size
+        existing = [int(name[6:11]) for name in os.listdir(dest_folder) if name.startswith("shard-") and name.endswith(".npz")]
+        self.shard_index = max(existing, default=-1) + 1
+        self.clear()
+
+    def clear(self):
+        self.names = []
+        self.widths = []
+        self.heights = []
+        self.object_counts = []
+        self.objects = []
+
+    def add(self, image_path, width, height, objects_info):
+        """Add annotation of one image, return shard filename and committed image names when shard is full"""
+        self.names.append(os.path.basename(image_path))
+        self.widths.append(width)
+        self.heights.append(height)
+        self.object_counts.append(len(objects_info))
+        self.objects.extend((obj["index"], obj["xmin"], obj["xmax"], obj["ymin"], obj["ymax"]) for obj in objects_info)
+        if len(self.names) >= self.shard_size:
+            return self.commit()
+        return None, []
+
+    def commit(self):
+        """Write collected annotations to the next shard, return shard filename and committed image names"""
+        if not self.names:
+            return None, []
+        shard_filename = f"shard-{self.shard_index:05d}.npz"
+        shard_path = os.path.join(self.dest_folder, shard_filename)
+        objects = np.array(self.objects, dtype=np.int32).reshape(-1, 5)
+        with open(shard_path + ".tmp", "wb") as file:
+            np.savez(file,
+                     image=np.array(self.names),
+                     image_width=np.array(self.widths, dtype=np.int32),
+                     image_height=np.array(self.heights, dtype=np.int32),
+                     object_count=np.array(self.object_counts, dtype=np.int32),
+                     object_class=objects[:, 0],
+                     xmin=objects[:, 1],
+                     xmax=objects[:, 2],
+                     ymin=objects[:, 3],
+                     ymax=objects[:, 4])
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(shard_path + ".tmp", shard_path)
+
+        names = self.names
+        self.shard_index += 1
+        self.clear()
+        return shard_filename, names
+
+def read_shard(shard_path):
+    """Yield image name, width, height and objects of every image in shard"""
+    with np.load(shard_path) as shard:
+        columns = {key: shard[key] for key in shard.files}
+    ends = np.cumsum(columns["object_count"])
+    starts = ends - columns["object_count"]
+    for i, name in enumerate(columns["image"]):
+        objects_info = [
+            {
+                "index": int(columns["object_class"][j]),
+                "xmin": int(columns["xmin"][j]),
+                "xmax": int(columns["xmax"][j]),
+                "ymin": int(columns["ymin"][j]),
+                "ymax": int(columns["ymax"][j]),
+            }
+            for j in range(starts[i], ends[i])
+        ]
+        yield str(name), int(columns["image_width"][i]), int(columns["image_height"][i]), objects_info
+
+def convert_shards_to_yolo(dest_folder, yolo_folder):
+    """Write one YOLO .txt file per image from shards in dest folder
+
+    When the manifest exists, only the current annotation of images that still exist is written."""
+    current = None
+    if os.path.exists(os.path.join(dest_folder, MANIFEST_FILENAME)):
+        manifest = open_manifest(dest_folder)
+        current = dict(manifest.execute("SELECT name, label FROM masks"))
+        manifest.close()
+
+    os.makedirs(yolo_folder, exist_ok=True)
+    shard_filenames = sorted(name for name in os.listdir(dest_folder) if name.startswith("shard-") and name.endswith(".npz"))
+    for shard_filename in shard_filenames:
+        for name, width, height, objects_info in read_shard(os.path.join(dest_folder, shard_filename)):
+            if current is not None and current.get(name) != shard_filename:
+                continue
+            create_annotation_txt(name, yolo_folder, width, height, objects_info)
 
 def read_classes_from_file(file_path):
     with open(file_path, 'r') as file:
         classes = [line.strip() for line in file.readlines()]
     return classes
 
-def process_images_parallel_in_folder(args, num_processes=10):
+def default_workers():
+    """Number of CPUs this process is allowed to run on"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def auto_chunksize(num_images, num_processes):
+    """Send about four chunks to every worker, at most 64 images per chunk"""
+    return max(1, min(64, num_images // (num_processes * 4)))
+
+def init_worker():
+    """Keep OpenCV single threaded so it does not compete with other workers"""
+    cv2.setNumThreads(1)
+
+@functools.lru_cache(maxsize=None)
+def load_palette(palette_path):
+    """Load mask palette once per process"""
+    return maskPalette.load_palette(palette_path)
+
+def find_palette(args):
+    """Palette given on command line, else palette the addon wrote next to the masks, else None"""
+    if args.palette:
+        return args.palette
+    palette_path = os.path.join(args.source, maskPalette.PALETTE_FILENAME)
+    return palette_path if os.path.exists(palette_path) else None
+
+def process_image_args(image_path, args, classes):
+    """Build process_image arguments for one image from command line arguments and class names"""
+    stride = args.stride or (1 if args.mode == "components" else 2)
+    return (image_path, args.dest, len(classes), stride, args.mode, args.min_area, args.fragment_ratio, args.decode, find_palette(args),
+            SEGMENT_OPTIONS[args.segments], args.polygon_tolerance, FORMATS[args.format], args.image_extension, tuple(classes))
+
+def label_extension(formats):
+    """Extension of the first per-image label file written for formats, empty if there is none"""
+    return next((LABEL_EXTENSIONS[label_format] for label_format in formats if label_format in LABEL_EXTENSIONS), "")
+
+def is_labeled(image_path, dest_folder, extension=".txt"):
+    """Check if label of the image exists and is newer than the image"""
+    label_filename = os.path.splitext(os.path.basename(image_path))[0] + extension
+    label_path = os.path.join(dest_folder, label_filename)
+    return os.path.exists(label_path) and os.path.getmtime(label_path) >= os.path.getmtime(image_path)
+
+def file_digest(path):
+    """Content hash of a file"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def open_manifest(dest_folder):
+    """Open manifest of labeled images in destination folder, create it if it does not exist"""
+    connection = sqlite3.connect(os.path.join(dest_folder, MANIFEST_FILENAME))
+    connection.execute("""CREATE TABLE IF NOT EXISTS masks (
+        name TEXT PRIMARY KEY,
+        size INTEGER,
+        mtime_ns INTEGER,
+        digest TEXT,
+        options TEXT,
+        label TEXT,
+        annotation TEXT)""")
+    columns = [row[1] for row in connection.execute("PRAGMA table_info(masks)")]
+    if "annotation" not in columns:
+        connection.execute("ALTER TABLE masks ADD COLUMN annotation TEXT")
+    return connection
+
+def manifest_annotations(manifest):
+    """Yield image name, width, height and objects of every image recorded in manifest"""
+    for name, annotation in manifest.execute("SELECT name, annotation FROM masks WHERE annotation IS NOT NULL ORDER BY name"):
+        width, height, objects = json.loads(annotation)
+        objects_info = [dict(zip(("index", "xmin", "xmax", "ymin", "ymax", "segmentation"), obj)) for obj in objects]
+        yield name, width, height, objects_info
+
+def remove_stale_labels(manifest, dest_folder, names):
+    """Remove manifest entries of images that no longer exist and labels no other image uses"""
+    for name in names:
+        label, = manifest.execute("SELECT label FROM masks WHERE name = ?", (name,)).fetchone()
+        manifest.execute("DELETE FROM masks WHERE name = ?", (name,))
+        if label.startswith("shard-"):
+            if manifest.execute("SELECT 1 FROM masks WHERE label = ?", (label,)).fetchone():
+                continue
+            label_paths = [os.path.join(dest_folder, label)]
+        else:
+            stem = os.path.splitext(name)[0]
+            label_paths = [os.path.join(dest_folder, stem + extension) for extension in LABEL_EXTENSIONS.values()]
+        for label_path in label_paths:
+            if os.path.exists(label_path):
+                os.remove(label_path)
+    manifest.commit()
+
+def process_images_parallel_in_folder(args, num_processes=None):
+    """Label new and changed images in folder
+
+    Every labeled image is recorded in the manifest in destination folder with its size,
+    modification time and labeling options, so an interrupted or repeated run only labels
+    images that are not recorded yet. With args.hash, images whose modification time changed
+    but content did not are not labeled again. Images are sent to the workers lazily in
+    chunks of args.chunksize (automatic when not set). With args.output "shards", labels are
+    collected in .npz shards and images are recorded when their shard is written.
+    Annotations are stored in the manifest too, the COCO file is streamed from it at the end."""
     folder_path = args.source
-    label_path = args.dest
     classes_path = args.classes
     classes = read_classes_from_file(classes_path)
-    num_classes = len(classes)
     print(f"Processing images in folder: {folder_path}")
 
-    image_files = [filename for filename in os.listdir(folder_path) if filename.endswith(('.png'))]
-    args_list = [(os.path.join(folder_path, filename), label_path, num_classes) for filename in image_files if filename.endswith(('.png'))]
+    manifest = open_manifest(args.dest)
+    # Class names only name VOC objects, renaming a class does not relabel images
+    options = " ".join(str(option) for option in process_image_args("", args, classes)[2:-1] + (args.output,))
+    formats = FORMATS[args.format]
+    recorded = {row[0]: row[1:] for row in manifest.execute("SELECT name, size, mtime_ns, digest, options FROM masks")}
 
-    with Pool(num_processes) as pool:
-        pool.map(process_image_wrapper, args_list)
+    signatures = {}
+    pending = []
+    with os.scandir(folder_path) as entries:
+        for entry in entries:
+            if not entry.name.endswith(MASK_EXTENSIONS):
+                continue
+            stat = entry.stat()
+            signature = (stat.st_size, stat.st_mtime_ns)
+            signatures[entry.name] = signature
+            record = recorded.get(entry.name)
+            if record is not None and record[3] == options:
+                if record[:2] == signature:
+                    continue
+                if args.hash and record[2] == file_digest(entry.path):
+                    manifest.execute("UPDATE masks SET size = ?, mtime_ns = ? WHERE name = ?", (*signature, entry.name))
+                    continue
+            pending.append(entry.name)
 
-if __name__ == '__main__':
+    remove_stale_labels(manifest, args.dest, recorded.keys() - signatures.keys())
+    num_processes = num_processes or default_workers()
+    chunksize = args.chunksize or auto_chunksize(len(pending), num_processes)
+    print(f"Labeling {len(pending)} of {len(signatures)} images with {num_processes} workers, {chunksize} images per chunk")
+
+    def record(name, label_filename, annotation):
+        image_path = os.path.join(folder_path, name)
+        digest = file_digest(image_path) if args.hash else None
+        width, height, objects_info = annotation
+        objects = [[obj["index"], obj["xmin"], obj["xmax"], obj["ymin"], obj["ymax"]] + ([obj["segmentation"]] if "segmentation" in obj else [])
+                   for obj in objects_info]
+        manifest.execute("INSERT OR REPLACE INTO masks (name, size, mtime_ns, digest, options, label, annotation) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         (name, *signatures[name], digest, options, label_filename, json.dumps([width, height, objects])))
+
+    args_iter = (process_image_args(os.path.join(folder_path, name), args, classes) for name in pending)
+    with Pool(num_processes, initializer=init_worker) as pool:
+        if args.output == "shards":
+            writer = ShardWriter(args.dest, args.shard_size)
+            uncommitted = {}
+            for image_path, annotation in pool.imap_unordered(label_image_wrapper, args_iter, chunksize):
+                if annotation is None:
+                    continue
+                uncommitted[os.path.basename(image_path)] = annotation
+                with stageTimer.stage("write", image_path):
+                    shard_filename, names = writer.add(image_path, *annotation)
+                if names:
+                    # One transaction per written shard
+                    for name in names:
+                        record(name, shard_filename, uncommitted.pop(name))
+                    manifest.commit()
+            shard_filename, names = writer.commit()
+            for name in names:
+                record(name, shard_filename, uncommitted.pop(name))
+        else:
+            extension = label_extension(formats)
+            for done, (image_path, annotation) in enumerate(pool.imap_unordered(process_image_wrapper, args_iter, chunksize), 1):
+                if annotation is None:
+                    continue
+                name = os.path.basename(image_path)
+                record(name, os.path.splitext(name)[0] + extension, annotation)
+                if done % 100 == 0:
+                    manifest.commit()
+    manifest.commit()
+
+    if "coco" in formats:
+        with stageTimer.stage("coco", COCO_FILENAME):
+            write_coco_json(manifest_annotations(manifest), classes, os.path.join(args.dest, COCO_FILENAME), args.image_extension)
+    manifest.close()
+
+def label_worker(queue):
+    """Process images from queue until None is received"""
+    init_worker()
+    while True:
+        args = queue.get()
+        if args is None:
+            break
+        process_image_wrapper(args)
+
+def watch_folder(args, num_processes=None):
+    """Label images as they are written to the source folder
+
+    An image is queued once its size and modification time are unchanged between two polls.
+    Watching stops when the sentinel file appears and every image is queued, or when no new
+    image appeared for idle_timeout seconds."""
+    folder_path = args.source
+    classes = read_classes_from_file(args.classes)
+    sentinel_path = os.path.join(folder_path, SENTINEL_FILENAME)
+    print(f"Watching folder: {folder_path}")
+
+    num_processes = num_processes or default_workers()
+    queue = Queue(maxsize=args.queue_size)
+    workers = [Process(target=label_worker, args=(queue,)) for _ in range(num_processes)]
+    for worker in workers:
+        worker.start()
+
+    signatures = {}
+    queued = set()
+    last_activity = time.monotonic()
+    try:
+        while True:
+            finished = os.path.exists(sentinel_path)
+            pending = False
+            with os.scandir(folder_path) as entries:
+                for entry in entries:
+                    if not entry.name.endswith(MASK_EXTENSIONS) or entry.name in queued:
+                        continue
+                    stat = entry.stat()
+                    signature = (stat.st_size, stat.st_mtime_ns)
+                    if stat.st_size > 0 and signatures.get(entry.name) == signature:
+                        queued.add(entry.name)
+                        last_activity = time.monotonic()
+                        if not is_labeled(entry.path, args.dest, label_extension(FORMATS[args.format])):
+                            queue.put(process_image_args(entry.path, args, classes))
+                    else:
+                        signatures[entry.name] = signature
+                        pending = True
+
+            if finished and not pending:
+                break
+            if time.monotonic() - last_activity > args.idle_timeout:
+                print(f"No new images for {args.idle_timeout} s, stopping")
+                break
+            time.sleep(args.poll_interval)
+    finally:
+        for _ in workers:
+            queue.put(None)
+        for worker in workers:
+            worker.join()
+    print(f"Labeled {len(queued)} images")
+
+def build_parser():
     parser = argparse.ArgumentParser(description="Label images from source to destination.")
     parser.add_argument("--source", type=str, help="Source folder containing images")
     parser.add_argument("--dest", type=str, help="Destination folder for labels")
     parser.add_argument("--classes", type=str, help=".txt file containing classes")
+    parser.add_argument("--stride", type=int, default=None, help="Sample every n-th pixel (default 2 for boxes, 1 for components)")
+    parser.add_argument("--mode", choices=["boxes", "components"], default="boxes", help="One box per object or one box per connected instance")
+    parser.add_argument("--min-area", type=int, default=0, help="Drop instances smaller than this many pixels (components mode)")
+    parser.add_argument("--fragment-ratio", type=float, default=0, help="Drop instances smaller than this fraction of the object's largest instance (components mode)")
+    parser.add_argument("--decode", choices=DECODERS, default="full", help="How masks are decoded, see read_mask")
+    parser.add_argument("--segments", choices=list(SEGMENT_OPTIONS), default="none", help="Also write object outlines: YOLO segmentation polygons and COCO polygons or RLE masks")
+    parser.add_argument("--polygon-tolerance", type=float, default=1.0, help="Largest distance in pixels of simplified polygon from the outline")
+    parser.add_argument("--palette", type=str, default=None, help="RGB mask palette file (default: palette.json in source folder if it exists), lossless masks only")
+    parser.add_argument("--timings", type=str, default=None, help="Append per-stage timing records to this JSONL file, see stageTimer.py")
+    parser.add_argument("--workers", type=int, default=default_workers(), help="Number of worker processes (default: available CPUs)")
+    parser.add_argument("--chunksize", type=int, default=None, help="Images sent to a worker at once (default: automatic)")
+    parser.add_argument("--format", choices=list(FORMATS), default="yolo", help="Label format, COCO is written to annotations.json in dest folder")
+    parser.add_argument("--image-extension", type=str, default=".jpg", help="Extension of rendered images named in VOC and COCO labels (.png for transparent renders)")
+    parser.add_argument("--output", choices=["txt", "shards"], default="txt", help="One label file per image or .npz shards of many images")
+    parser.add_argument("--shard-size", type=int, default=10000, help="Images per shard (shards output)")
+    parser.add_argument("--to-yolo", type=str, default=None, help="Convert shards in dest folder to YOLO .txt files in this folder and exit")
+    parser.add_argument("--hash", action="store_true", help="Compare image content, not only modification time, to find changed images")
+    parser.add_argument("--watch", action="store_true", help="Label images while they are being rendered")
+    parser.add_argument("--poll-interval", type=float, default=0.5, help="Seconds between folder scans (watch mode)")
+    parser.add_argument("--idle-timeout", type=float, default=600, help="Stop after this many seconds without new images (watch mode)")
+    parser.add_argument("--queue-size", type=int, default=64, help="Maximum number of images waiting for a worker (watch mode)")
+    return parser
+
+if __name__ == '__main__':
+    parser = build_parser()
     args = parser.parse_args()
+    if args.watch and args.output != "txt":
+        parser.error("--watch only supports txt output")
+    if args.watch and "coco" in FORMATS[args.format]:
+        parser.error("--watch does not support COCO format")
+    if args.output == "shards" and "voc" in FORMATS[args.format]:
+        parser.error("--output shards does not support VOC format")
+    if args.segments != "none" and args.output == "shards":
+        parser.error("--segments is not supported with shards output")
+    if "rle" in SEGMENT_OPTIONS[args.segments] and args.decode.startswith("reduced"):
+        parser.error("--segments rle needs a full resolution --decode")
+    if args.timings:
+        # Before workers start, they inherit it
+        stageTimer.enable(args.timings)
 
-    process_images_parallel_in_folder(args, num_processes=10)
+    if args.to_yolo:
+        convert_shards_to_yolo(args.dest, args.to_yolo)
+    elif args.watch:
+        watch_folder(args, num_processes=args.workers)
+    else:
+        process_images_parallel_in_folder(args, num_processes=args.workers)
@@ -0,0 +1,271 @@
+"""Labeling engine shared by labelImages.py and the addon
+
+Finds bounding boxes of objects in emission masks held in NumPy arrays, needs only NumPy.
+OpenCV is imported only to split objects into connected components.
+"""
+import math
+
+import numpy as np
+
+import maskPalette
+
+SEGMENTS = ("polygon", "rle")
+
+def red_channel(image):
+    """Red channel of a BGR image, single channel images are returned as they are"""
+    return image[:, :, 2] if image.ndim == 3 else image
+
+def to_uint8(red):
+    """Scale 16 bit and float mask (any channels) to 0-255 like an 8 bit mask"""
+    if red.dtype == np.uint8:
+        return red
+    if red.dtype == np.uint16:
+        return (red >> 8).astype(np.uint8)
+    return np.clip(np.rint(red * 255), 0, 255).astype(np.uint8)
+
+def value_extents(values, num_values=256):
+    """Get rows and columns in which every value (0 .. num_values - 1) of a 2D array is present"""
+    height, width = values.shape
+    rows_present = np.zeros((height, num_values), dtype=bool)
+    rows_present[np.arange(height)[:, None], values] = True
+    columns_present = np.zeros((width, num_values), dtype=bool)
+    columns_present[np.arange(width)[None, :], values] = True
+    return rows_present, columns_present
+
+def red_window(object_index, num_objects):
+    """Lowest and highest red value (inclusive) of object's palette window, object red channel +-1
+
+    Windows of neighboring objects overlap above 127 objects, every red value still has one."""
+    object_red_channel = (object_index + 1) * (255 / num_objects)
+    return math.ceil(object_red_channel - 1), math.floor(object_red_channel + 1)
+
+def find_objects(image, num_objects, stride=2):
+    """Find bounding box of every object in a BGR mask image or its red channel
+
+    Red channel is read once and binned by red value. Each object then combines
+    the red values inside its palette window (object red channel +-1), so the result
+    is the same as comparing every sampled pixel against every object."""
+    red = red_channel(image)[::stride, ::stride]
+    rows_present, columns_present = value_extents(red)
+    red_values = np.arange(256)
+
+    objects_info = []
+    for object_index in range(num_objects):
+        low, high = red_window(object_index, num_objects)
+        in_window = (low <= red_values) & (red_values <= high)
+        if not in_window.any():
+            continue
+        rows = np.flatnonzero(rows_present[:, in_window].any(axis=1))
+        if rows.size == 0:
+            continue
+        columns = np.flatnonzero(columns_present[:, in_window].any(axis=1))
+        objects_info.append({
+            "index": object_index,
+            "xmin": int(columns[0]) * stride,
+            "xmax": int(columns[-1]) * stride,
+            "ymin": int(rows[0]) * stride,
+            "ymax": int(rows[-1]) * stride,
+        })
+    return objects_info
+
+def class_index_lut(num_objects):
+    """Lookup table mapping every red value (0-255) to nearest object index, -1 for background"""
+    red_values = np.arange(256)
+    delta_red = 255 / num_objects
+    nearest = np.clip(np.rint(red_values / delta_red).astype(int) - 1, 0, num_objects - 1)
+    in_window = np.abs(red_values - (nearest + 1) * delta_red) <= 1
+    return np.where(in_window, nearest, -1).astype(np.int16)
+
+def class_index_map(image, num_objects, stride=1):
+    """Map every sampled pixel of a BGR mask image or its red channel to its object index"""
+    return class_index_lut(num_objects)[red_channel(image)[::stride, ::stride]]
+
+def index_map_boxes(index_map, num_indices, stride=1):
+    """Find bounding box of every index (0 .. num_indices - 1) in an index map sampled with stride, -1 is ignored"""
+    rows_present, columns_present = value_extents(index_map + 1, num_indices + 1)
+    rows_present, columns_present = rows_present[:, 1:], columns_present[:, 1:]
+    found = np.flatnonzero(rows_present.any(axis=0))
+    top = rows_present.argmax(axis=0)
+    bottom = len(rows_present) - 1 - rows_present[::-1].argmax(axis=0)
+    left = columns_present.argmax(axis=0)
+    right = len(columns_present) - 1 - columns_present[::-1].argmax(axis=0)
+    return [
+        {
+            "index": int(i),
+            "xmin": int(left[i]) * stride,
+            "xmax": int(right[i]) * stride,
+            "ymin": int(top[i]) * stride,
+            "ymax": int(bottom[i]) * stride,
+        }
+        for i in found
+    ]
+
+def split_instances(index_map, objects_info, stride=1, min_area=0, fragment_ratio=0):
+    """Split boxes of objects in an index map sampled with stride into boxes of connected instances
+
+    Connected components are searched only inside each object's overall bounding box.
+    Instances smaller than min_area pixels (full resolution) are dropped, as are fragments
+    smaller than fragment_ratio of the largest instance of the same object."""
+    # Blender's Python may not have OpenCV, boxes mode works without it
+    import cv2
+    instances_info = []
+    for obj in objects_info:
+        top, left = obj["ymin"] // stride, obj["xmin"] // stride
+        crop = index_map[top:obj["ymax"] // stride + 1, left:obj["xmax"] // stride + 1]
+        mask = (crop == obj["index"]).astype(np.uint8)
+        count, labels, stats, centroids = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        stats = stats[1:]
+        areas = stats[:, cv2.CC_STAT_AREA] * stride * stride
+        if areas.size == 0:
+            continue
+        keep = (areas >= min_area) & (areas >= fragment_ratio * areas.max())
+        for x, y, w, h, area in stats[keep]:
+            instances_info.append({
+                "index": obj["index"],
+                "xmin": int(left + x) * stride,
+                "xmax": int(left + x + w - 1) * stride,
+                "ymin": int(top + y) * stride,
+                "ymax": int(top + y + h - 1) * stride,
+            })
+    return instances_info
+
+def find_object_instances(image, num_objects, stride=1, min_area=0, fragment_ratio=0):
+    """Find bounding box of every connected instance of every object in a BGR mask image or its red channel"""
+    class_map = class_index_map(image, num_objects, stride)
+    return split_instances(class_map, find_objects(image, num_objects, stride), stride, min_area, fragment_ratio)
+
+def palette_index_map(image, num_objects, stride=1):
+    """Map every sampled pixel of a BGR mask image colored with maskPalette to its object index"""
+    index_map = maskPalette.object_index_map(image, stride)
+    # Noise can form valid colors of ids the palette does not use
+    index_map[index_map >= num_objects] = -1
+    return index_map
+
+def rle_counts(mask, top, left, height, width):
+    """COCO run lengths (column-major, background first) of a mask crop at top, left of a height x width image"""
+    # Background padding in every column, so runs never cross columns and alternate start, end
+    column_length = mask.shape[0] + 2
+    columns = np.pad(mask.T, ((0, 0), (1, 1))).ravel()
+    edges = np.flatnonzero(columns[1:] != columns[:-1])
+    edge_columns, edge_rows = np.divmod(edges, column_length)
+    positions = (left + edge_columns) * height + top + edge_rows
+    starts, ends = positions[0::2], positions[1::2]
+    if starts.size:
+        # A run reaching the bottom of a column continues at the top of the next one
+        joined = ends[:-1] == starts[1:]
+        starts, ends = starts[np.r_[True, ~joined]], ends[np.r_[~joined, True]]
+    edges = np.empty(2 * len(starts) + 2, dtype=np.int64)
+    edges[0], edges[-1] = 0, height * width
+    edges[1:-1:2], edges[2:-1:2] = starts, ends
+    counts = np.diff(edges)
+    return counts[:-1] if counts[-1] == 0 and len(counts) > 1 else counts
+
+def rle_string(counts):
+    """Compress run lengths to a COCO RLE string, same as pycocotools rleToString
+
+    Counts after the third are stored as difference to the count two before, in groups of
+    5 bits with a continuation bit, offset to printable characters."""
+    values = counts.astype(np.int64)
+    values[3:] -= counts[1:-2]
+    shifts = np.arange(7) * 5
+    digits = (values[:, None] >> shifts) & 0x1f
+    rest = values[:, None] >> (shifts + 5)
+    done = np.where(digits & 0x10, rest == -1, rest == 0)
+    lengths = done.argmax(axis=1) + 1
+    positions = np.arange(7)
+    chars = digits | np.where(positions < (lengths - 1)[:, None], 0x20, 0)
+    return (chars[positions < lengths[:, None]] + 48).astype(np.uint8).tobytes().decode("ascii")
+
+def mask_polygon(mask, top, left, tolerance):
+    """Outline of the largest part of a mask crop at top, left, simplified by tolerance pixels, as [[x, y], ...]"""
+    import cv2
+    contours, hierarchy = cv2.findContours(mask.astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=(left, top))
+    contour = max(contours, key=lambda contour: (cv2.contourArea(contour), len(contour)))
+    return cv2.approxPolyDP(contour, tolerance, True)[:, 0].tolist()
+
+def instance_mask(mask, box):
+    """Largest connected part of mask whose bounding box contains box (x0, y0, x1, y1 in crop)"""
+    import cv2
+    count, labels, stats, centroids = cv2.connectedComponentsWithStats(mask.astype(np.uint8), connectivity=8)
+    x, y, w, h, area = stats[1:].T
+    contains = (x <= box[0]) & (y <= box[1]) & (x + w - 1 >= box[2]) & (y + h - 1 >= box[3])
+    areas = np.where(contains, area, -1)
+    return labels == areas.argmax() + 1
+
+def add_segments(image, object_mask, objects_info, segments, tolerance=1.0, stride=1, instances=False):
+    """Add "segmentation" with pixel area and requested "polygon" and "rle" to every object
+
+    object_mask(crop, index) returns the pixels of a crop of the full resolution image that
+    belong to the object with map index still held in "index", so only pixels near objects
+    are decoded. Boxes found with stride can miss pixels between
+    samples, so crops start stride - 1 pixels larger and are grown by stride until the object
+    does not touch their border.
+    With instances, only the connected part covering the object's box is segmented."""
+    height, width = image.shape[:2]
+    for obj in objects_info:
+        margin = stride - 1
+        top, left = max(0, obj["ymin"] - margin), max(0, obj["xmin"] - margin)
+        bottom, right = min(height, obj["ymax"] + margin + 1), min(width, obj["xmax"] + margin + 1)
+        while True:
+            mask = object_mask(image[top:bottom, left:right], obj["index"])
+            if stride == 1:
+                break
+            grown = (max(0, top - stride) if top > 0 and mask[0].any() else top,
+                     max(0, left - stride) if left > 0 and mask[:, 0].any() else left,
+                     min(height, bottom + stride) if bottom < height and mask[-1].any() else bottom,
+                     min(width, right + stride) if right < width and mask[:, -1].any() else right)
+            if grown == (top, left, bottom, right):
+                break
+            top, left, bottom, right = grown
+        if instances:
+            mask = instance_mask(mask, (obj["xmin"] - left, obj["ymin"] - top, obj["xmax"] - left, obj["ymax"] - top))
+        segmentation = {"area": int(np.count_nonzero(mask))}
+        if "polygon" in segments:
+            polygon = mask_polygon(mask, top, left, tolerance)
+            if len(polygon) < 3:
+                polygon = [[obj["xmin"], obj["ymin"]], [obj["xmax"], obj["ymin"]], [obj["xmax"], obj["ymax"]], [obj["xmin"], obj["ymax"]]]
+            segmentation["polygon"] = polygon
+        if "rle" in segments:
+            segmentation["rle"] = {"size": [height, width], "counts": rle_string(rle_counts(mask, top, left, height, width))}
+        obj["segmentation"] = segmentation
+
+def find_palette_objects(image, palette, stride=1, mode="boxes", min_area=0, fragment_ratio=0, segments=(), tolerance=1.0):
+    """Find bounding box of every object in a BGR mask image colored with maskPalette
+
+    Every object gets its class index from the palette and its instance number as "instance".
+    In components mode objects are further split into connected parts. segments are added
+    with add_segments."""
+    num_objects = len(palette["objects"])
+    index_map = palette_index_map(image, num_objects, stride)
+    objects_info = index_map_boxes(index_map, num_objects, stride)
+    if mode == "components":
+        objects_info = split_instances(index_map, objects_info, stride, min_area, fragment_ratio)
+    if segments:
+        def object_mask(crop, index):
+            return palette_index_map(crop, num_objects) == index
+        add_segments(image, object_mask, objects_info, segments, tolerance, stride, mode == "components")
+    for obj in objects_info:
+        obj["index"], obj["instance"] = palette["objects"][obj["index"]]
+    return objects_info
+
+def label_array(image, num_objects, stride=2, mode="boxes", min_area=0, fragment_ratio=0, palette=None, segments=(), tolerance=1.0):
+    """Find objects in a mask held in memory, return image width, height and objects
+
+    image is a BGR mask or its red channel, 8 bit, 16 bit or float (0-1). With palette (see
+    maskPalette), colors are decoded as RGB ids and num_objects is ignored. segments
+    ("polygon", "rle") are computed at full resolution from the same class map."""
+    height, width = image.shape[:2]
+    if palette is not None:
+        return width, height, find_palette_objects(to_uint8(image), palette, stride, mode, min_area, fragment_ratio, segments, tolerance)
+    red = to_uint8(red_channel(image))
+    if mode == "components":
+        objects_info = find_object_instances(red, num_objects, stride, min_area, fragment_ratio)
+    else:
+        objects_info = find_objects(red, num_objects, stride)
+    if segments:
+        # Red values of an object are one window, comparing is faster than a lookup table
+        def object_mask(crop, index):
+            low, high = red_window(index, num_objects)
+            return (crop >= low) & (crop <= high)
+        add_segments(red, object_mask, objects_info, segments, tolerance, stride, mode == "components")
+    return width, height, objects_info
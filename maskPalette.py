@@ -0,0 +1,88 @@
+"""RGB instance ID palette of emission masks
+
+Object ids 1..MAX_OBJECTS (0 is background) are written as colors with red and green each
+holding one of LEVELS evenly spaced levels and blue a checksum level of the two, so a palette
+holds at most 255 objects. Levels are 17 apart, so a channel can drift by TOLERANCE before
+it is read wrong, and a color changed in a single channel, e.g. blended on object edges,
+fails the checksum and is ignored.
+Masks must be lossless (PNG, BMP, EXR). JPEG changes several channels at once near edges
+and is not supported: most decoded boxes are wrong.
+Used by the addon to color emission materials and by labelImages.py to decode masks
+with one lookup table pass.
+"""
+import json
+import os
+
+import numpy as np
+
+LEVELS = 16
+STEP = 255 // (LEVELS - 1)
+TOLERANCE = STEP // 2 - 1
+MAX_OBJECTS = LEVELS * LEVELS - 1
+PALETTE_FILENAME = "palette.json"
+
+
+def checksum(red_level, green_level):
+    """Blue level of a color, 3 and 5 are invertible modulo LEVELS so one changed level is detected"""
+    return (3 * red_level + 5 * green_level) % LEVELS
+
+
+def id_color(object_id):
+    """RGB color (0-255) of object id"""
+    red_level, green_level = object_id % LEVELS, object_id // LEVELS
+    return red_level * STEP, green_level * STEP, checksum(red_level, green_level) * STEP
+
+
+def make_palette(object_classes):
+    """Palette of objects with given class indices, object i gets id i + 1
+
+    Instances are numbered per class in object order."""
+    if len(object_classes) > MAX_OBJECTS:
+        raise ValueError(f"Mask palette holds at most {MAX_OBJECTS} objects, got {len(object_classes)}")
+    instances = {}
+    objects = []
+    for class_index in object_classes:
+        instance = instances.get(class_index, 0)
+        instances[class_index] = instance + 1
+        objects.append([class_index, instance])
+    return {"levels": LEVELS, "objects": objects}
+
+
+def save_palette(path, palette):
+    """Write palette to JSON file, atomically as render farm shards write it concurrently"""
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as file:
+        json.dump(palette, file)
+    os.replace(temp_path, path)
+
+
+def load_palette(path):
+    """Read palette from JSON file and check it uses the same levels"""
+    with open(path) as file:
+        palette = json.load(file)
+    if palette["levels"] != LEVELS:
+        raise ValueError(f"Palette {path} uses {palette['levels']} levels, expected {LEVELS}")
+    return palette
+
+
+def make_decode_luts():
+    """Lookup tables from channel value to level (LEVELS if invalid) and from levels to object index"""
+    values = np.arange(256)
+    nearest = np.rint(values / STEP).astype(int)
+    level_lut = np.where(np.abs(values - nearest * STEP) <= TOLERANCE, nearest, LEVELS)
+
+    red, green, blue = np.meshgrid(np.arange(LEVELS + 1), np.arange(LEVELS + 1), np.arange(LEVELS + 1), indexing="ij")
+    valid = (red < LEVELS) & (green < LEVELS) & (blue < LEVELS) & (blue == checksum(red, green))
+    object_lut = np.where(valid, red + green * LEVELS - 1, -1).astype(np.int16)
+    return level_lut.astype(np.int16), object_lut.ravel()
+
+
+LEVEL_LUT, OBJECT_LUT = make_decode_luts()
+
+
+def object_index_map(image, stride=1):
+    """Map every sampled pixel of BGR mask image to object index (id - 1), -1 for background and invalid colors"""
+    image = image[::stride, ::stride]
+    levels = LEVEL_LUT[image]
+    code = (levels[:, :, 2] * (LEVELS + 1) + levels[:, :, 1]) * (LEVELS + 1) + levels[:, :, 0]
+    return OBJECT_LUT[code]
@@ -0,0 +1,74 @@
+"""Render a range of images without the user interface
+
+Run inside Blender, usually started by renderFarm.py:
+    blender -b file.blend -P renderDriver.py -- --config run.json
+    blender -b file.blend -P renderDriver.py -- --config run.json --offset 0 --count 100 --seed 1
+
+The config file is the same JSON file renderFarm.py reads. Without --offset and --count,
+all images of the run are rendered ("image_offset" and "number_of_images" of the config)
+and the sentinel is written when they are done. Without --seed, "seed" of the config is used. "collection" and "output_path"
+are required, the names in OPTIONAL_PROPERTIES override addon properties saved in the
+.blend file.
+"""
+import argparse
+import json
+import os
+import sys
+
+import bpy
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import imageGenerationAddon
+
+OPTIONAL_PROPERTIES = ("environment_strength", "max_offset", "render_profile", "render_time_limit", "background_mode", "mask_format", "mask_palette", "mask_labeling", "annotation_mode", "render_passes",
+                       "max_simulation_frames", "settle_threshold", "collision_shape", "plan_path", "timings_path")
+
+def parse_args():
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+    parser = argparse.ArgumentParser(description="Render a range of images in background Blender.")
+    parser.add_argument("--config", type=str, required=True, help="JSON file with run settings")
+    parser.add_argument("--offset", type=int, default=None, help="Number of first image (default: image_offset of config, else 0)")
+    parser.add_argument("--count", type=int, default=None, help="Number of images to render (default: number_of_images of config)")
+    parser.add_argument("--seed", type=int, default=None, help="Seed of scene randomization (default: seed of config)")
+    parser.add_argument("--progress", type=str, default=None, help="File to write number of last finished image to")
+    parser.add_argument("--write-plan", action="store_true", help="Only write scene plan of the images to plan_path")
+    return parser.parse_args(argv)
+
+def write_progress(progress_path, offset):
+    """Replace progress file content with number of last finished image"""
+    with open(progress_path + ".tmp", "w") as file:
+        file.write(str(offset))
+    os.replace(progress_path + ".tmp", progress_path)
+
+def configure(config, offset, count):
+    """Set addon properties of the scene from config"""
+    if not hasattr(bpy.types.Scene, "my_tool"):
+        imageGenerationAddon.register()
+    mytool = bpy.context.scene.my_tool
+    mytool.my_collection = bpy.data.collections[config["collection"]]
+    mytool.output_path = os.path.join(config["output_path"], "")
+    for name in OPTIONAL_PROPERTIES:
+        if name in config:
+            setattr(mytool, name, config[name])
+    mytool.image_offset = offset
+    mytool.number_of_images = count
+
+if __name__ == "__main__":
+    args = parse_args()
+    with open(args.config) as file:
+        config = json.load(file)
+    offset = config.get("image_offset", 0) if args.offset is None else args.offset
+    count = config["number_of_images"] if args.count is None else args.count
+    seed = config.get("seed") if args.seed is None else args.seed
+    # Only a driver rendering the whole run knows that all images are done
+    whole_run = args.offset is None and args.count is None
+    configure(config, offset, count)
+    if args.write_plan:
+        imageGenerationAddon.verify_collection()
+        imageGenerationAddon.write_scene_plan(seed)
+        sys.exit(0)
+
+    on_image_done = None
+    if args.progress:
+        on_image_done = lambda offset: write_progress(args.progress, offset)
+    imageGenerationAddon.generate(seed=seed, on_image_done=on_image_done, write_sentinel=whole_run)
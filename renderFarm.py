@@ -0,0 +1,159 @@
+"""Render images with several background Blender processes on one machine
+
+Every process renders a disjoint range of image numbers. All processes get the same seed,
+the addon seeds every image from it and the image number, so scenes do not depend on the
+number of workers. A process that crashes is started again from the image after the last
+one it finished. Progress files are named by image range, so a later run with another
+number of workers does not skip images; --fresh forgets the progress of earlier runs.
+Run with:
+    python renderFarm.py --config run.json --workers 8
+
+run.json holds "blend" (the .blend file), "collection", "output_path", "number_of_images"
+and optionally "image_offset", "seed", "blender" (executable, default blender) and the
+properties renderDriver.py overrides. With "plan_path", scenes of all images are planned
+once before the shards start.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+DRIVER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "renderDriver.py")
+SENTINEL_FILENAME = ".done"
+
+class Shard:
+    """Range of images [start, end) rendered by one Blender process"""
+
+    def __init__(self, index, start, end, seed, progress_folder):
+        self.index = index
+        self.start = start
+        self.end = end
+        self.seed = seed
+        self.progress_path = os.path.join(progress_folder, f"images{start}-{end - 1}.txt")
+        self.next = start
+        self.process = None
+        self.restarts = 0
+
+    def update_next(self):
+        """Read number of the first image that is not rendered yet from progress file"""
+        if os.path.exists(self.progress_path):
+            with open(self.progress_path) as file:
+                content = file.read().strip()
+            # Ignore progress of images outside the range, e.g. from an edited file
+            if content.isdigit() and self.start <= int(content) < self.end:
+                self.next = max(self.next, int(content) + 1)
+
+    def done(self):
+        return self.next >= self.end
+
+def split_range(offset, count, num_shards):
+    """Split count images from offset into num_shards contiguous ranges of almost equal size"""
+    bounds = [offset + count * i // num_shards for i in range(num_shards + 1)]
+    return [(bounds[i], bounds[i + 1]) for i in range(num_shards) if bounds[i] < bounds[i + 1]]
+
+def start_shard(shard, config, config_path, threads, log_folder):
+    """Start Blender process rendering the rest of the shard"""
+    command = [
+        config.get("blender", "blender"), "-b", config["blend"], "-t", str(threads),
+        "-P", DRIVER_PATH, "--",
+        "--config", config_path,
+        "--offset", str(shard.next),
+        "--count", str(shard.end - shard.next),
+        "--seed", str(shard.seed),
+        "--progress", shard.progress_path,
+    ]
+    log = open(os.path.join(log_folder, f"shard{shard.index}.log"), "a")
+    shard.process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT)
+    log.close()
+
+def write_plan(config, config_path):
+    """Plan scenes of all images once, before shards read the plan"""
+    command = [
+        config.get("blender", "blender"), "-b", config["blend"],
+        "-P", DRIVER_PATH, "--",
+        "--config", config_path,
+        "--offset", str(config.get("image_offset", 0)),
+        "--count", str(config["number_of_images"]),
+        "--seed", str(config.get("seed", 0)),
+        "--write-plan",
+    ]
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+
+def prepare_output_folder(output_path, fresh=False):
+    """Create output subfolders before the shards do it concurrently, remove old sentinel
+
+    With fresh, progress files of earlier runs are removed so every image is rendered again."""
+    for name in ("black", "images", "labels", "progress"):
+        os.makedirs(os.path.join(output_path, name), exist_ok=True)
+    if fresh:
+        progress_folder = os.path.join(output_path, "progress")
+        for entry in os.scandir(progress_folder):
+            if entry.name.endswith(".txt"):
+                os.remove(entry.path)
+    sentinel_path = os.path.join(output_path, "black", SENTINEL_FILENAME)
+    if os.path.exists(sentinel_path):
+        os.remove(sentinel_path)
+
+def run(config, config_path, num_workers, max_restarts, poll_interval, fresh=False):
+    """Render all images of config with num_workers Blender processes, return True on success"""
+    output_path = config["output_path"]
+    prepare_output_folder(output_path, fresh)
+    if config.get("plan_path") and not os.path.exists(config["plan_path"]):
+        write_plan(config, config_path)
+    progress_folder = os.path.join(output_path, "progress")
+    threads = max(1, (os.cpu_count() or 1) // num_workers)
+    seed = config.get("seed", 0)
+
+    ranges = split_range(config.get("image_offset", 0), config["number_of_images"], num_workers)
+    shards = [Shard(i, start, end, seed, progress_folder) for i, (start, end) in enumerate(ranges)]
+    for shard in shards:
+        shard.update_next()
+        if not shard.done():
+            start_shard(shard, config, config_path, threads, progress_folder)
+
+    total = sum(shard.end - shard.start for shard in shards)
+    failed = False
+    while any(shard.process is not None for shard in shards):
+        time.sleep(poll_interval)
+        for shard in shards:
+            if shard.process is None:
+                continue
+            shard.update_next()
+            returncode = shard.process.poll()
+            if returncode is None:
+                continue
+            shard.process = None
+            if shard.done():
+                continue
+            if shard.restarts >= max_restarts:
+                print(f"Shard {shard.index} failed {shard.restarts + 1} times, images {shard.next}-{shard.end - 1} are missing")
+                failed = True
+                continue
+            shard.restarts += 1
+            print(f"Shard {shard.index} exited with code {returncode}, restarting from image {shard.next}")
+            start_shard(shard, config, config_path, threads, progress_folder)
+
+        rendered = sum(shard.next - shard.start for shard in shards)
+        print(f"Rendered {rendered}/{total} images", end="\r")
+    print()
+
+    if not failed:
+        open(os.path.join(output_path, "black", SENTINEL_FILENAME), "w").close()
+    return not failed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render images with several background Blender processes.")
+    parser.add_argument("--config", type=str, required=True, help="JSON file with run settings")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of Blender processes")
+    parser.add_argument("--max-restarts", type=int, default=3, help="Times a crashed shard is started again")
+    parser.add_argument("--poll-interval", type=float, default=2, help="Seconds between progress checks")
+    parser.add_argument("--fresh", action="store_true", help="Forget progress of earlier runs and render every image again")
+    args = parser.parse_args()
+
+    config_path = os.path.abspath(args.config)
+    with open(config_path) as file:
+        config = json.load(file)
+    success = run(config, config_path, args.workers, args.max_restarts, args.poll_interval, args.fresh)
+    sys.exit(0 if success else 1)
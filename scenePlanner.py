@@ -0,0 +1,161 @@
+"""Precomputed, reproducible object locations and rotations for a whole run
+
+Pure NumPy, so plans can be made and benchmarked without Blender. A plan is a structured
+NumPy array with one row per image (image number, locations and rotations of every
+top-level object), saved as .npy so every render worker can memory map it and look up
+its images by number. Rotations are in radians, in the order of the collection objects.
+"""
+import math
+
+import numpy as np
+
+# Objects are placed at most this many times before overlapping is accepted
+MAX_ATTEMPTS = 100
+# Cell slots in one spatial hash chunk, images are planned in chunks that fit in it
+GRID_CELLS_PER_CHUNK = 1 << 24
+# Most cells per side of a spatial hash grid, cells grow for small objects in a large area
+MAX_GRID_SIZE = 256
+
+
+def plan_dtype(num_objects):
+    return np.dtype([
+        ("image", np.int64),
+        ("locations", np.float32, (num_objects, 3)),
+        ("rotations", np.float32, (num_objects, 3)),
+    ])
+
+
+def plan_rotations(rng, num_images, default_angles):
+    """Rotation of every object in every image, in radians
+
+    Like rotate_objects in the addon: with probability 1/2 all three angles are random
+    whole degrees, otherwise the object's default angles are used with a random angle
+    around its free axis. default_angles holds (rx, ry, rz, free axis) in degrees or None
+    for every object, objects without default angles are always rotated randomly."""
+    num_objects = len(default_angles)
+    rotations = rng.integers(0, 360, (num_images, num_objects, 3)).astype(np.float64)
+    use_default = rng.integers(0, 2, (num_images, num_objects)).astype(bool)
+    for k, angles in enumerate(default_angles):
+        if angles is None:
+            continue
+        free_axis = int(angles[3])
+        fixed = [axis for axis in range(3) if axis != free_axis]
+        rows = use_default[:, k]
+        rotations[rows, k, fixed[0]] = angles[fixed[0]]
+        rotations[rows, k, fixed[1]] = angles[fixed[1]]
+    return np.radians(rotations)
+
+
+def sample_disc(rng, count, max_offset):
+    """Points in max_offset disc, distance from center is uniform like place_objects in the addon"""
+    angle = rng.uniform(0, 2 * math.pi, count)
+    r = rng.uniform(0, max_offset, count)
+    return np.column_stack((r * np.cos(angle), r * np.sin(angle)))
+
+
+def spatial_hash_grid(radii, max_offset):
+    """Cell size, cells per side and object slots per cell of the spatial hash of the objects
+
+    Cells are at least the largest diameter, so a candidate can only overlap objects in the
+    3 x 3 cells around its own. Centers of objects placed without overlapping are at least
+    the smallest diameter apart, which bounds how many fit in a cell; there are never more
+    slots than objects, so grid size does not depend on the ratio of the radii."""
+    cell_size = max(2 * radii.max(), 2 * max_offset / MAX_GRID_SIZE, 1e-6)
+    grid_size = int(math.ceil(2 * max_offset / cell_size)) + 3
+    smallest = 2 * radii.min()
+    capacity = len(radii)
+    if smallest > 0:
+        capacity = min(capacity, int(math.ceil(cell_size * math.sqrt(2) / smallest)) ** 2)
+    return cell_size, grid_size, capacity
+
+
+def plan_chunk_xy(rng, num_images, radii, max_offset):
+    """Place objects of num_images images one after another, rejecting overlapping bounding circles
+
+    Every image has a spatial hash grid, see spatial_hash_grid. While fewer objects are placed
+    than there are slots in the 3 x 3 cells, a candidate is compared with the placed objects
+    directly.
+    Return (num_images, objects, 2) locations and number of objects that were placed
+    overlapping after MAX_ATTEMPTS."""
+    num_objects = len(radii)
+    cell_size, grid_size, capacity = spatial_hash_grid(radii, max_offset)
+    window = np.arange(-1, 2)
+
+    grid = np.full((num_images, grid_size, grid_size, capacity), -1, dtype=np.int32)
+    counts = np.zeros((num_images, grid_size, grid_size), dtype=np.int32)
+    xy = np.zeros((num_images, num_objects, 2))
+    overlapping = 0
+
+    def cells(points):
+        return np.floor((points + max_offset) / cell_size).astype(np.int64) + 1
+
+    for k in range(num_objects):
+        todo = np.arange(num_images)
+        for attempt in range(MAX_ATTEMPTS):
+            candidates = sample_disc(rng, len(todo), max_offset)
+            cx, cy = cells(candidates).T
+            if k <= len(window) ** 2 * capacity:
+                neighbours = np.broadcast_to(np.arange(k), (len(todo), k))
+            else:
+                neighbours = grid[todo[:, None, None], cx[:, None, None] + window[None, :, None], cy[:, None, None] + window[None, None, :]]
+                neighbours = neighbours.reshape(len(todo), -1)
+            present = neighbours >= 0
+            neighbour_xy = xy[todo[:, None], np.where(present, neighbours, 0)]
+            distance = np.linalg.norm(neighbour_xy - candidates[:, None, :], axis=2)
+            clear = ~(present & (distance < radii[k] + radii[np.where(present, neighbours, 0)])).any(axis=1)
+            if attempt == MAX_ATTEMPTS - 1:
+                overlapping += int((~clear).sum())
+                clear[:] = True
+            placed = todo[clear]
+            xy[placed, k] = candidates[clear]
+            # A cell can already be full when overlapping is accepted, keep the first objects there
+            px, py = cx[clear], cy[clear]
+            slots = counts[placed, px, py]
+            free = slots < capacity
+            grid[placed[free], px[free], py[free], slots[free]] = k
+            counts[placed[free], px[free], py[free]] += 1
+            todo = todo[~clear]
+            if len(todo) == 0:
+                break
+    return xy, overlapping
+
+
+def make_plan(seed, first_image, num_images, radii, drop_heights, default_angles, max_offset):
+    """Plan locations and rotations of objects for images first_image .. first_image + num_images - 1
+
+    radii are bounding sphere radii of the objects, drop_heights the heights they are placed
+    at before simulation. Return plan array and number of objects placed overlapping."""
+    rng = np.random.default_rng(seed)
+    radii = np.asarray(radii, dtype=np.float64)
+    num_objects = len(radii)
+    plan = np.zeros(num_images, dtype=plan_dtype(num_objects))
+    plan["image"] = np.arange(first_image, first_image + num_images)
+    plan["rotations"] = plan_rotations(rng, num_images, default_angles)
+    plan["locations"][:, :, 2] = np.asarray(drop_heights, dtype=np.float64)
+
+    overlapping = 0
+    if num_objects:
+        cell_size, grid_size, capacity = spatial_hash_grid(radii, max_offset)
+        chunk = max(1, GRID_CELLS_PER_CHUNK // (grid_size ** 2 * capacity))
+        for start in range(0, num_images, chunk):
+            xy, chunk_overlapping = plan_chunk_xy(rng, min(chunk, num_images - start), radii, max_offset)
+            plan["locations"][start:start + chunk, :, :2] = xy
+            overlapping += chunk_overlapping
+    return plan, overlapping
+
+
+def save_plan(path, plan):
+    np.save(path, plan)
+
+
+def load_plan(path):
+    """Memory map plan saved with save_plan"""
+    return np.load(path, mmap_mode="r")
+
+
+def plan_entry(plan, image):
+    """Locations and rotations of objects in image"""
+    row = plan[image - int(plan[0]["image"])]
+    if row["image"] != image:
+        raise ValueError(f"Image {image} is not in plan")
+    return row["locations"], row["rotations"]
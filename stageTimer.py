@@ -0,0 +1,136 @@
+"""Per-stage timing records of the render and labeling pipeline
+
+When enabled, every timed stage appends one JSON line with stage name, image, start time,
+duration and process id to a shared file. Lines are written with a single O_APPEND write,
+so Blender shards and labeler workers can share one file. When disabled, stage() returns
+a shared no-op context manager.
+
+Enable with the IMAGEGEN_TIMINGS environment variable (inherited by worker processes),
+labelImages.py --timings or the addon's Timings File. Summarize records with:
+    python stageTimer.py timings.jsonl
+"""
+import argparse
+import contextlib
+import json
+import os
+import time
+
+import numpy as np
+
+TIMINGS_ENV = "IMAGEGEN_TIMINGS"
+PERCENTILES = (50, 90, 99)
+
+NULL_STAGE = contextlib.nullcontext()
+
+
+class StageTimer:
+    """Append timing records to a JSONL file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+    def record(self, stage, image, start, seconds):
+        image = os.path.splitext(os.path.basename(str(image)))[0]
+        line = json.dumps({"stage": stage, "image": image, "start": start, "seconds": seconds, "pid": os.getpid()})
+        os.write(self.fd, (line + "\n").encode())
+
+    @contextlib.contextmanager
+    def stage(self, stage, image):
+        start = time.time()
+        counter = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, image, start, time.perf_counter() - counter)
+
+    def close(self):
+        os.close(self.fd)
+
+
+timer = StageTimer(os.environ[TIMINGS_ENV]) if os.environ.get(TIMINGS_ENV) else None
+
+def enable(path):
+    """Append records of this process and of workers started later to path"""
+    global timer
+    if timer is not None and timer.path == path:
+        return
+    disable()
+    os.environ[TIMINGS_ENV] = path
+    timer = StageTimer(path)
+
+def disable():
+    global timer
+    if timer is not None:
+        timer.close()
+        timer = None
+    os.environ.pop(TIMINGS_ENV, None)
+
+def stage(name, image):
+    """Context manager timing one stage of one image (path, name or number)"""
+    if timer is None:
+        return NULL_STAGE
+    return timer.stage(name, image)
+
+
+def read_records(paths):
+    """Read timing records of all files, skipping lines cut short by a killed process"""
+    records = []
+    for path in paths:
+        with open(path) as file:
+            for line in file:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    return records
+
+def summarize(records):
+    """Per stage statistics in order of first appearance
+
+    Throughput is images per second of wall time from the stage's first start to its
+    last end, so it includes parallelism across workers."""
+    stages = {}
+    for record in records:
+        stages.setdefault(record["stage"], []).append(record)
+
+    summary = []
+    for name, stage_records in stages.items():
+        seconds = np.array([record["seconds"] for record in stage_records])
+        starts = np.array([record["start"] for record in stage_records])
+        wall = (starts + seconds).max() - starts.min()
+        summary.append({
+            "stage": name,
+            "count": len(stage_records),
+            "workers": len({record["pid"] for record in stage_records}),
+            "total": float(seconds.sum()),
+            "mean": float(seconds.mean()),
+            "percentiles": [float(value) for value in np.percentile(seconds, PERCENTILES)],
+            "max": float(seconds.max()),
+            "throughput": len(stage_records) / wall if wall > 0 else float("inf"),
+        })
+    return summary
+
+def print_summary(summary):
+    total = sum(row["total"] for row in summary) or 1
+    header = " ".join(f"{f'p{p} ms':>9}" for p in PERCENTILES)
+    print(f"{'stage':16} {'count':>7} {'workers':>7} {'total s':>9} {'share':>6} {'mean ms':>9} {header} {'max ms':>9} {'images/s':>9}")
+    for row in summary:
+        percentiles = " ".join(f"{value * 1000:9.2f}" for value in row["percentiles"])
+        print(f"{row['stage']:16} {row['count']:7} {row['workers']:7} {row['total']:9.2f} {row['total'] / total:6.1%} "
+              f"{row['mean'] * 1000:9.2f} {percentiles} {row['max'] * 1000:9.2f} {row['throughput']:9.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Summarize per-stage timing records.")
+    parser.add_argument("files", nargs="+", help="JSONL timing files")
+    parser.add_argument("--json", action="store_true", help="Print summary as JSON, e.g. to compare runs")
+    args = parser.parse_args()
+
+    summary = summarize(read_records(args.files))
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    elif not summary:
+        print("No timing records")
+    else:
+        print_summary(summary)